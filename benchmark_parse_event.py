@@ -0,0 +1,70 @@
+"""
+Benchmark de parse_event por fuente de evento (SQS, HTTP API v2, taskToken, directo).
+
+    python benchmark_parse_event.py [iteraciones]
+"""
+import json
+import os
+import sys
+import timeit
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import estado_pedidos  # noqa: E402
+
+DATOS = {
+    "tenant_id": "TENANT1",
+    "id_pedido": "PEDIDO-0001",
+    "id_empleado": "EMP-7",
+    "repartidor": "Juan",
+    "origen": "Local Centro",
+    "destino": "Av. Siempre Viva 742"
+}
+
+EVENTOS = {
+    "sqs": {
+        "Records": [{
+            "messageId": "1",
+            "eventSource": "aws:sqs",
+            "body": json.dumps(DATOS)
+        }]
+    },
+    "http_post": {
+        "version": "2.0",
+        "routeKey": "POST /pedidos/{id_pedido}/pagado-a-cocina",
+        "requestContext": {"http": {"method": "POST"}},
+        "pathParameters": {"id_pedido": DATOS["id_pedido"]},
+        "queryStringParameters": {"tenant_id": DATOS["tenant_id"]},
+        "body": json.dumps({"id_empleado": DATOS["id_empleado"]}),
+        "isBase64Encoded": False
+    },
+    "http_get": {
+        "version": "2.0",
+        "routeKey": "GET /pedidos/{id_pedido}",
+        "requestContext": {"http": {"method": "GET"}},
+        "pathParameters": {"id_pedido": DATOS["id_pedido"]},
+        "queryStringParameters": {"tenant_id": DATOS["tenant_id"]},
+        "isBase64Encoded": False
+    },
+    "task_token": {
+        "taskToken": "AAAAKgAAAAIAAAAAAAAAA" * 20,
+        "input": DATOS
+    },
+    "directo": DATOS
+}
+
+
+def main():
+    iteraciones = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    esquema = estado_pedidos.ESQUEMA_TRANSICION
+
+    print(f"{'fuente':<12} {'us/evento':>10}")
+    for fuente, event in EVENTOS.items():
+        solicitud, error = estado_pedidos.parse_event(event, esquema)
+        assert error is None, (fuente, error)
+        total = timeit.timeit(lambda: estado_pedidos.parse_event(event, esquema), number=iteraciones)
+        print(f"{fuente:<12} {total / iteraciones * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
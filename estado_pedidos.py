@@ -1,22 +1,66 @@
 import os
 import json
+import time
+import functools
+import heapq
+import random
 import boto3
-from datetime import datetime, timezone
+from botocore.config import Config
+from botocore.exceptions import ClientError, BotoCoreError, HTTPClientError
+from botocore.exceptions import ConnectionError as ErrorConexionAWS
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 from boto3.dynamodb.conditions import Key, Attr
 
-dynamodb = boto3.resource("dynamodb")
-stepfunctions_client = boto3.client("stepfunctions")
+# ------------------------- Configuración de clientes AWS ------------------------- #
+
+# Intentos totales (incluye el primero) por llamada
+AWS_MAX_INTENTOS = int(os.getenv("AWS_MAX_INTENTOS", "3"))
+AWS_CONNECT_TIMEOUT = float(os.getenv("AWS_CONNECT_TIMEOUT", "1"))
+AWS_READ_TIMEOUT = float(os.getenv("AWS_READ_TIMEOUT", "3"))
+# Tiempo (ms) que se reserva al final de la Lambda para responder / devolver el mensaje
+MARGEN_DEADLINE_MS = int(os.getenv("MARGEN_DEADLINE_MS", "1500"))
+# read_timeout mínimo aceptable cuando hay que recortarlo por el deadline
+AWS_READ_TIMEOUT_MIN = 0.5
+AWS_BACKOFF_MAX_S = 20  # tope del backoff exponencial de botocore
+CIRCUITO_UMBRAL_FALLOS = int(os.getenv("CIRCUITO_UMBRAL_FALLOS", "5"))
+CIRCUITO_ENFRIAMIENTO_S = float(os.getenv("CIRCUITO_ENFRIAMIENTO_S", "30"))
+
+def crear_config_aws(intentos, read_timeout):
+    return Config(
+        retries={"total_max_attempts": intentos, "mode": "adaptive"},
+        connect_timeout=AWS_CONNECT_TIMEOUT,
+        read_timeout=read_timeout
+    )
+
+
+def duracion_maxima_s(intentos, read_timeout):
+    """
+    Peor caso de una llamada con reintentos: cada intento agota connect + read
+    y entre intentos botocore espera hasta 2^k s (con tope AWS_BACKOFF_MAX_S).
+    """
+    espera = sum(min(AWS_BACKOFF_MAX_S, 2 ** k) for k in range(intentos - 1))
+    return intentos * (AWS_CONNECT_TIMEOUT + read_timeout) + espera
+
+
+config_aws = crear_config_aws(AWS_MAX_INTENTOS, AWS_READ_TIMEOUT)
+DURACION_MAXIMA_LLAMADA_S = duracion_maxima_s(AWS_MAX_INTENTOS, AWS_READ_TIMEOUT)
+
+dynamodb = boto3.resource("dynamodb", config=config_aws)
+stepfunctions_client = boto3.client("stepfunctions", config=config_aws)
+sqs_client = boto3.client("sqs", config=config_aws)
 
 TABLA_PEDIDOS = os.getenv("TABLA_PEDIDOS", "PEDIDOS")
 TABLA_COCINA = os.getenv("TABLA_COCINA", "COCINA")
 TABLA_DESPACHADOR = os.getenv("TABLA_DESPACHADOR", "DESPACHADOR")
 TABLA_DELIVERY = os.getenv("TABLA_DELIVERY", "DELIVERY")
+TABLA_TIEMPOS_COCINA = os.getenv("TABLA_TIEMPOS_COCINA", "TIEMPOS_COCINA")
 
 tabla_pedidos = dynamodb.Table(TABLA_PEDIDOS)
 tabla_cocina = dynamodb.Table(TABLA_COCINA)
 tabla_despachador = dynamodb.Table(TABLA_DESPACHADOR)
 tabla_delivery = dynamodb.Table(TABLA_DELIVERY)
+tabla_tiempos_cocina = dynamodb.Table(TABLA_TIEMPOS_COCINA)
 
 
 # ------------------------- Utilitarios ------------------------- #
@@ -33,67 +77,485 @@ def decimal_default(obj):
 def obtener_timestamp_iso():
     return datetime.now(timezone.utc).isoformat()
 
-def parse_event(event):
+def segundos_entre(inicio_iso, fin_iso):
+    try:
+        inicio = datetime.fromisoformat(inicio_iso)
+        fin = datetime.fromisoformat(fin_iso)
+    except (TypeError, ValueError):
+        return None
+    return (fin - inicio).total_seconds()
+
+
+# ------------------------- Reintentos, deadlines y circuit breaker ------------------------- #
+
+CODIGOS_THROTTLING = {
+    "ThrottlingException",
+    "Throttling",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException"
+}
+
+# Contadores por contenedor (se mantienen entre invocaciones "calientes")
+metricas_aws = {
+    "llamadas": 0,
+    "reintentos": 0,
+    "throttles": 0,
+    "errores": 0,
+    "deadlines_excedidos": 0,
+    "rechazos_circuito": 0
+}
+
+estado_circuito = {
+    "fallos_consecutivos": 0,
+    "abierto_hasta": 0.0
+}
+
+
+def contar_intento_aws(response=None, **kwargs):
     """
-    Normaliza el event para:
-    - SQS: event["Records"][0]["body"] con JSON
-    - Step Functions con waitForTaskToken: { "taskToken": "...", "input": {...} }
-    - HTTP API (GET y POST)
-    - Step Functions normal: input directo
+    Handler del evento 'needs-retry' de botocore: se emite en cada intento, también
+    en los que botocore reintenta y después salen bien, así que cuenta todos los
+    throttles y no solo el error final.
     """
-    # --- Evento desde SQS ---
-    if "Records" in event and isinstance(event["Records"], list) and event["Records"]:
-        record = event["Records"][0]
-        if record.get("eventSource") == "aws:sqs":
-            body_str = record.get("body", "{}")
-            try:
-                body = json.loads(body_str)
-            except Exception:
-                body = {"raw_body": body_str}
-            return body
-
-    # --- STEP FUNCTIONS waitForTaskToken ---
-    if "taskToken" in event and "input" in event and isinstance(event["input"], dict):
-        base = event["input"].copy()
-        base["taskToken"] = event["taskToken"]
-        return base
-
-    # ------------------------------------------------------------------
-    # 🟦 NUEVO: NORMALIZAR HTTP API (GET o POST)
-    # ------------------------------------------------------------------
-    if event.get("version") == "2.0":  # HTTP API siempre tiene version 2.0
-        result = {}
-
-        # Query params
-        if event.get("queryStringParameters"):
-            for k, v in event["queryStringParameters"].items():
-                result[k] = v
-
-        # Path params
-        if event.get("pathParameters"):
-            for k, v in event["pathParameters"].items():
-                result[k] = v
-
-        # Body si existe (POST)
-        body = event.get("body")
-        if body:
-            try:
-                body_data = json.loads(body)
-                if isinstance(body_data, dict):
-                    for k, v in body_data.items():
-                        result[k] = v
-            except:
-                pass
+    if response is not None:
+        codigo = response[1].get("Error", {}).get("Code")
+        if codigo in CODIGOS_THROTTLING:
+            metricas_aws["throttles"] += 1
+
+
+def registrar_eventos_aws(cliente):
+    cliente.meta.events.register("needs-retry", contar_intento_aws)
+    return cliente
+
+
+for cliente_aws in (dynamodb.meta.client, stepfunctions_client, sqs_client):
+    registrar_eventos_aws(cliente_aws)
+
+
+class CircuitoAbierto(Exception):
+    pass
+
+
+class DeadlineExcedido(Exception):
+    pass
+
+
+def obtener_metricas_aws():
+    return dict(metricas_aws, circuito_abierto=estado_circuito["abierto_hasta"] > time.monotonic())
+
+
+def es_error_transitorio(error):
+    """
+    Throttling, errores 5xx, errores de red/timeout, circuito abierto y deadline
+    son transitorios (vale la pena reintentar). Errores de negocio
+    (ConditionalCheckFailed, validación...) y el resto de BotoCoreError
+    (parámetros inválidos, sin credenciales, sin región) no: reintentarlos no los arregla.
+    """
+    if isinstance(error, (ErrorConexionAWS, HTTPClientError, CircuitoAbierto, DeadlineExcedido)):
+        return True
+    if isinstance(error, ClientError):
+        codigo = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return codigo in CODIGOS_THROTTLING or status >= 500
+    return False
+
+
+def registrar_fallo_circuito():
+    estado_circuito["fallos_consecutivos"] += 1
+    if estado_circuito["fallos_consecutivos"] >= CIRCUITO_UMBRAL_FALLOS:
+        estado_circuito["abierto_hasta"] = time.monotonic() + CIRCUITO_ENFRIAMIENTO_S
+
+
+# (servicio | "dynamodb", intentos, read_timeout) -> cliente / recurso con esa configuración
+clientes_por_presupuesto = {}
+
+
+def configuracion_para_presupuesto(presupuesto_s):
+    """
+    Elige (intentos, read_timeout) para que el peor caso de la llamada quepa en
+    presupuesto_s. Primero baja los intentos; si ni uno solo cabe, recorta el
+    read_timeout (en pasos de 0.5 s para no crear un cliente por cada ms).
+    Devuelve None si no alcanza ni para un intento con AWS_READ_TIMEOUT_MIN.
+    """
+    for intentos in range(AWS_MAX_INTENTOS, 0, -1):
+        if duracion_maxima_s(intentos, AWS_READ_TIMEOUT) <= presupuesto_s:
+            return intentos, AWS_READ_TIMEOUT
+    read_timeout = int((presupuesto_s - AWS_CONNECT_TIMEOUT) / AWS_READ_TIMEOUT_MIN) * AWS_READ_TIMEOUT_MIN
+    if read_timeout < AWS_READ_TIMEOUT_MIN:
+        return None
+    return 1, read_timeout
+
+
+def operacion_con_presupuesto(operacion, intentos, read_timeout):
+    """
+    Devuelve la misma operación (ej. tabla_cocina.put_item) pero sobre un cliente
+    boto3 configurado con (intentos, read_timeout). Los objetos que no son de boto3
+    (ej. stub_aws) se devuelven tal cual.
+    """
+    duenio = getattr(operacion, "__self__", None)
+    meta = getattr(duenio, "meta", None)
+    if meta is None:
+        return operacion
+
+    if hasattr(meta, "service_model"):
+        servicio = meta.service_model.service_name
+    else:
+        servicio = "dynamodb"  # recurso DynamoDB (ServiceResource o Table)
+
+    clave = (servicio, intentos, read_timeout)
+    nuevo = clientes_por_presupuesto.get(clave)
+    if nuevo is None:
+        config = crear_config_aws(intentos, read_timeout)
+        if servicio == "dynamodb":
+            nuevo = boto3.resource("dynamodb", config=config)
+            registrar_eventos_aws(nuevo.meta.client)
+        else:
+            nuevo = registrar_eventos_aws(boto3.client(servicio, config=config))
+        clientes_por_presupuesto[clave] = nuevo
+
+    if servicio == "dynamodb" and hasattr(duenio, "name"):
+        nuevo = nuevo.Table(duenio.name)
+    return getattr(nuevo, operacion.__name__)
+
+
+def llamar_aws(operacion, context, afecta_circuito=True, **kwargs):
+    """
+    Ejecuta una llamada a DynamoDB / Step Functions / SQS:
+      - Falla rápido si el circuito está abierto
+      - Ajusta intentos / read_timeout para que la llamada (con reintentos) termine
+        antes de restante - MARGEN_DEADLINE_MS; si no alcanza, falla rápido (deadline)
+      - Cuenta llamadas, reintentos y errores (los reintentos los hace botocore en modo
+        adaptive; los throttles se cuentan por intento en contar_intento_aws)
+    afecta_circuito=False: llamadas accesorias (ej. el modelo de tiempos) que no deben
+    abrir ni cerrar el circuito de las transiciones.
+    """
+    if estado_circuito["abierto_hasta"] > time.monotonic():
+        metricas_aws["rechazos_circuito"] += 1
+        raise CircuitoAbierto("Circuito abierto hacia AWS, se rechaza la llamada")
+
+    if context is not None:
+        restante_ms = context.get_remaining_time_in_millis()
+        presupuesto_s = (restante_ms - MARGEN_DEADLINE_MS) / 1000.0
+        if presupuesto_s < DURACION_MAXIMA_LLAMADA_S:
+            configuracion = configuracion_para_presupuesto(presupuesto_s)
+            if configuracion is None:
+                metricas_aws["deadlines_excedidos"] += 1
+                raise DeadlineExcedido(f"Quedan {restante_ms} ms, insuficiente para llamar a AWS")
+            operacion = operacion_con_presupuesto(operacion, *configuracion)
+
+    metricas_aws["llamadas"] += 1
+    try:
+        resp = operacion(**kwargs)
+    except (ClientError, BotoCoreError) as e:
+        metricas_aws["errores"] += 1
+        if isinstance(e, ClientError):
+            metricas_aws["reintentos"] += e.response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        if afecta_circuito and es_error_transitorio(e):
+            registrar_fallo_circuito()
+        raise
+
+    metricas_aws["reintentos"] += resp.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    if afecta_circuito:
+        estado_circuito["fallos_consecutivos"] = 0
+        estado_circuito["abierto_hasta"] = 0.0
+    return resp
+
+
+ERRORES_AWS = (CircuitoAbierto, DeadlineExcedido, ClientError, BotoCoreError)
+
+
+def es_evento_sqs(event):
+    records = event.get("Records") if isinstance(event, dict) else None
+    return (isinstance(records, list) and bool(records) and isinstance(records[0], dict)
+            and records[0].get("eventSource") == "aws:sqs")
+
+
+def con_proteccion_aws(handler):
+    """
+    Decorador para las Lambdas de transición:
+      - Si viene de SQS y AWS falla de forma transitoria, relanza la excepción para que
+        el mensaje vuelva a la cola (se reintenta tras el VisibilityTimeout)
+      - Si viene de HTTP, responde 503 en vez de esperar al timeout de la Lambda
+      - Loguea las métricas de reintentos/throttles al final de cada invocación
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        try:
+            return handler(event, context)
+        except ERRORES_AWS as e:
+            if not es_error_transitorio(e):
+                raise
+            print("ERROR AWS transitorio:", repr(e))
+            if es_evento_sqs(event):
+                raise
+            return {
+                "statusCode": 503,
+                "body": json.dumps({
+                    "mensaje": "Servicio temporalmente no disponible, reintente más tarde",
+                    "detalle": str(e)
+                })
+            }
+        finally:
+            print("METRICAS aws:", json.dumps(obtener_metricas_aws()))
+    return wrapper
+
+# ------------------------- Parseo de eventos ------------------------- #
+
+class Solicitud:
+    """
+    Vista de solo lectura sobre el event ya decodificado.
+    No mezcla diccionarios: guarda referencias a las fuentes (body, path, query...)
+    en orden de prioridad y busca la clave en ellas.
+    """
+    __slots__ = ("fuente", "fuentes")
+
+    def __init__(self, fuente, fuentes):
+        self.fuente = fuente      # 'sqs' | 'http' | 'task_token' | 'directo'
+        self.fuentes = fuentes    # tupla de dicts, el primero tiene prioridad
+
+    def get(self, clave, default=None):
+        for datos in self.fuentes:
+            if clave in datos:
+                return datos[clave]
+        return default
+
+    def __contains__(self, clave):
+        for datos in self.fuentes:
+            if clave in datos:
+                return True
+        return False
+
+    def a_dict(self):
+        """Copia mezclada, solo para logs / respuestas de error."""
+        resultado = {}
+        for datos in reversed(self.fuentes):
+            resultado.update(datos)
+        return resultado
+
+
+class Lote:
+    """
+    Mensaje SQS con varios pedidos del mismo tenant:
+      { "tenant_id": "...", "pedidos": [ {"id_pedido": "...", ...}, ... ], "intento": 0 }
+    Cada pedido se expone como una Solicitud (pedido > campos comunes del sobre).
+    """
+    __slots__ = ("tenant_id", "cuerpo", "pedidos", "invalidos", "intento", "origen_arn")
+
+    def __init__(self, cuerpo, origen_arn):
+        self.tenant_id = cuerpo.get("tenant_id")
+        self.cuerpo = cuerpo
+        self.pedidos = [Solicitud("sqs", (p, cuerpo)) if isinstance(p, dict) else p
+                        for p in cuerpo["pedidos"]]
+        self.invalidos = []   # [(id_pedido | posición, detalle)]
+        self.intento = cuerpo.get("intento", 0)
+        self.origen_arn = origen_arn
+
+
+class EventoInvalido(Exception):
+    pass
+
 
-        return result
-    # ------------------------------------------------------------------
+MAX_PEDIDOS_POR_MENSAJE = 100  # un solo BatchGetItem por sobre
 
-    # --- Caso Step Functions u otro que mande un dict simple ---
-    return event
 
+VACIO = {}
 
-def obtener_pedido(tenant_id: str, id_pedido: str):
-    resp = tabla_pedidos.get_item(
+
+def decodificar_json(cuerpo):
+    if cuerpo is None or cuerpo == "":
+        return VACIO
+    try:
+        datos = json.loads(cuerpo)
+    except (TypeError, ValueError) as e:
+        raise EventoInvalido(f"Body no es JSON válido: {e}")
+    if not isinstance(datos, dict):
+        raise EventoInvalido("El body debe ser un objeto JSON")
+    return datos
+
+
+def parsear_sqs(event):
+    # batchSize = 1: solo se procesa el primer record
+    records = event["Records"]
+    if not isinstance(records, list) or not records:
+        raise EventoInvalido("'Records' debe ser una lista no vacía")
+    record = records[0]
+    if not isinstance(record, dict):
+        raise EventoInvalido("Cada record de 'Records' debe ser un objeto")
+    if record.get("eventSource") != "aws:sqs":
+        raise EventoInvalido(f"eventSource no soportado: {record.get('eventSource')}")
+    datos = decodificar_json(record.get("body"))
+    if "pedidos" in datos:
+        if not isinstance(datos["pedidos"], list):
+            raise EventoInvalido("'pedidos' debe ser una lista")
+        return Lote(datos, record.get("eventSourceARN"))
+    return Solicitud("sqs", (datos,))
+
+
+def parsear_http(event):
+    # HTTP API v2: prioridad body > path params > query params
+    body = event.get("body")
+    if body and event.get("isBase64Encoded"):
+        raise EventoInvalido("Body en base64 no soportado")
+    return Solicitud("http", (
+        decodificar_json(body),
+        event.get("pathParameters") or VACIO,
+        event.get("queryStringParameters") or VACIO
+    ))
+
+
+def parsear_task_token(event):
+    # Step Functions waitForTaskToken: { "taskToken": "...", "input": {...} }
+    datos = event.get("input")
+    if not isinstance(datos, dict):
+        raise EventoInvalido("'input' debe ser un objeto cuando se envía taskToken")
+    return Solicitud("task_token", ({"taskToken": event["taskToken"]}, datos))
+
+
+# Se despacha por la primera clave presente en el event
+PARSERS_POR_CLAVE = (
+    ("Records", parsear_sqs),
+    ("requestContext", parsear_http),
+    ("taskToken", parsear_task_token)
+)
+
+
+def compilar_esquema(requeridos, tipos=None, alias=None):
+    """
+    Precalcula las reglas de validación: (campo, nombres aceptados, tipos, requerido).
+    alias permite aceptar otro nombre para el mismo campo (ej. 'id' para 'id_pedido').
+    """
+    tipos = tipos or {}
+    alias = alias or {}
+    campos = list(requeridos) + [c for c in tipos if c not in requeridos]
+    return tuple(
+        (campo, (campo,) + tuple(alias.get(campo, ())), tipos.get(campo, str), campo in requeridos)
+        for campo in campos
+    )
+
+
+def validar_esquema(solicitud, esquema):
+    """Un campo vacío ("") cuenta como faltante."""
+    faltantes = []
+    for campo, nombres, tipo, requerido in esquema:
+        for nombre in nombres:
+            valor = solicitud.get(nombre)
+            if valor is not None and valor != "":
+                if not isinstance(valor, tipo):
+                    raise EventoInvalido(f"El campo '{nombre}' tiene un tipo inválido")
+                break
+        else:
+            if requerido:
+                faltantes.append(campo)
+    if faltantes:
+        raise EventoInvalido(f"Faltan campos requeridos: {', '.join(faltantes)}")
+
+
+def validar_lote(lote, esquema):
+    """
+    Errores del sobre (tenant_id, lista de pedidos) invalidan todo el mensaje.
+    Errores de un pedido solo lo sacan del lote (queda en lote.invalidos).
+    """
+    if not isinstance(lote.tenant_id, str) or not lote.tenant_id:
+        raise EventoInvalido("El sobre de pedidos debe incluir tenant_id")
+    if not lote.pedidos or len(lote.pedidos) > MAX_PEDIDOS_POR_MENSAJE:
+        raise EventoInvalido(f"'pedidos' debe tener entre 1 y {MAX_PEDIDOS_POR_MENSAJE} elementos")
+    if not isinstance(lote.intento, int):
+        raise EventoInvalido("'intento' debe ser entero")
+
+    validos = []
+    vistos = set()
+    for posicion, solicitud in enumerate(lote.pedidos):
+        if not isinstance(solicitud, Solicitud):
+            lote.invalidos.append((posicion, "Cada pedido debe ser un objeto"))
+            continue
+        id_pedido = solicitud.get("id_pedido") or solicitud.get("id")
+        try:
+            if solicitud.get("tenant_id") != lote.tenant_id:
+                raise EventoInvalido("Todos los pedidos del sobre deben ser del mismo tenant")
+            if esquema:
+                validar_esquema(solicitud, esquema)
+            if id_pedido in vistos:
+                raise EventoInvalido("Pedido repetido en el sobre")
+        except EventoInvalido as e:
+            lote.invalidos.append((id_pedido if isinstance(id_pedido, str) else posicion, str(e)))
+            continue
+        vistos.add(id_pedido)
+        validos.append(solicitud)
+    lote.pedidos = validos
+
+
+def parse_event(event, esquema=None):
+    """
+    Normaliza el event en una Solicitud y lo valida contra el esquema (si se pasa).
+    Fuentes soportadas:
+    - SQS: event["Records"][0]["body"] con JSON (un pedido o un sobre con "pedidos" -> Lote)
+    - HTTP API v2 (GET y POST): body > pathParameters > queryStringParameters
+    - Step Functions con waitForTaskToken: { "taskToken": "...", "input": {...} }
+    - Step Functions normal: input directo
+    Devuelve (solicitud, error_response | None), igual que validar_pedido_y_estado.
+    """
+    try:
+        if not isinstance(event, dict):
+            raise EventoInvalido("El event debe ser un objeto")
+        for clave, parser in PARSERS_POR_CLAVE:
+            if clave in event:
+                solicitud = parser(event)
+                break
+        else:
+            solicitud = Solicitud("directo", (event,))
+        if isinstance(solicitud, Lote):
+            validar_lote(solicitud, esquema)
+        elif esquema:
+            validar_esquema(solicitud, esquema)
+    except EventoInvalido as e:
+        return None, {
+            "statusCode": 400,
+            "body": json.dumps({
+                "mensaje": "Evento inválido",
+                "detalle": str(e)
+            })
+        }
+    return solicitud, None
+
+
+ESQUEMA_TRANSICION = compilar_esquema(
+    requeridos=("tenant_id", "id_pedido"),
+    tipos={
+        "id_empleado": (str, int),
+        "repartidor": str,
+        "id_repartidor": (str, int),
+        "origen": str,
+        "destino": str,
+        "taskToken": str
+    },
+    alias={"id_pedido": ("id",)}
+)
+
+ESQUEMA_OBTENER_PEDIDO = compilar_esquema(
+    requeridos=("tenant_id", "id_pedido"),
+    alias={"id_pedido": ("path_id_pedido",)}
+)
+
+ESQUEMA_LISTAR_PEDIDOS = compilar_esquema(requeridos=("tenant_id", "estado"))
+
+ESQUEMA_COLA_COCINA = compilar_esquema(requeridos=("tenant_id",))
+
+ESQUEMA_CONFIRMAR_PASO = compilar_esquema(
+    requeridos=("tenant_id", "id_pedido", "paso"),
+    tipos={
+        "id_empleado": (str, int),
+        "repartidor": str,
+        "id_repartidor": (str, int),
+        "origen": str,
+        "destino": str
+    },
+    alias={"id_pedido": ("id",)}
+)
+
+
+def leer_pedido(tenant_id: str, id_pedido: str, context=None):
+    resp = llamar_aws(tabla_pedidos.get_item, context,
         Key={
             "tenant_id": tenant_id,
             "id": id_pedido
@@ -102,23 +564,16 @@ def obtener_pedido(tenant_id: str, id_pedido: str):
     return resp.get("Item")
 
 
-def validar_pedido_y_estado(event, estado_esperado: str):
+def validar_pedido_y_estado(event, estado_esperado: str, context=None):
     """
     Devuelve (pedido, error_response | None)
     Si hay error, pedido será None y error_response será el dict de respuesta HTTP.
+    El event ya viene validado con ESQUEMA_TRANSICION (tenant_id e id_pedido presentes).
     """
     tenant_id = event.get("tenant_id")
     id_pedido = event.get("id_pedido") or event.get("id")
 
-    if not tenant_id or not id_pedido:
-        return None, {
-            "statusCode": 400,
-            "body": json.dumps({
-                "mensaje": "Faltan tenant_id o id_pedido en el event"
-            })
-        }
-
-    pedido = obtener_pedido(tenant_id, id_pedido)
+    pedido = leer_pedido(tenant_id, id_pedido, context)
     if not pedido:
         return None, {
             "statusCode": 404,
@@ -142,8 +597,516 @@ def validar_pedido_y_estado(event, estado_esperado: str):
     return pedido, None
 
 
+# ------------------------- Registros de cada etapa ------------------------- #
+
+def crear_item_cocina(event, pedido):
+    return {
+        "id_pedido": pedido["id"],
+        "id_empleado": event.get("id_empleado") or "no_asignado",
+        "hora_comienzo": obtener_timestamp_iso(),
+        "hora_fin": None,
+        "status": "cocinando"
+    }
+
+
+def crear_item_despachador(event, pedido):
+    return {
+        "id_pedido": pedido["id"],
+        "id_empleado": event.get("id_empleado") or "no_asignado",
+        "hora_comienzo": obtener_timestamp_iso(),
+        "hora_fin": None,
+        "status": "cocinando"  # puedes cambiar el texto a 'empaquetando' si quieres
+    }
+
+
+def crear_item_delivery(event, pedido):
+    return {
+        "id_pedido": pedido["id"],
+        "tenant_id": pedido["tenant_id"],
+        "repartidor": event.get("repartidor") or "no_asignado",
+        "id_repartidor": event.get("id_repartidor") or "no_asignado",
+        "origen": event.get("origen") or "no_definido",
+        "destino": event.get("destino") or "no_definido",
+        "status": "en camino"
+    }
+
+
+def cerrar_etapa(tabla, id_pedido, context):
+    """
+    Marca hora_fin y status='terminado' en COCINA / DESPACHADOR, solo si la etapa
+    sigue abierta. Devuelve el item cerrado, o None si ya estaba cerrada (reentrega
+    de SQS o re-encolado): así no se pisa la hora_fin original.
+    """
+    try:
+        resp = llamar_aws(tabla.update_item, context,
+            Key={"id_pedido": id_pedido},
+            UpdateExpression="SET hora_fin = :hf, #st = :s",
+            ConditionExpression="#st = :abierta",
+            ExpressionAttributeNames={"#st": "status"},
+            ExpressionAttributeValues={
+                ":hf": obtener_timestamp_iso(),
+                ":s": "terminado",
+                ":abierta": "cocinando"
+            },
+            ReturnValues="ALL_NEW"
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+            return None
+        raise
+    return resp.get("Attributes", {})
+
+
+# ------------------------- Modelo de tiempos de cocina ------------------------- #
+
+# Media móvil exponencial por tenant de (hora_fin - hora_comienzo) en COCINA.
+# Se guarda en TIEMPOS_COCINA (un item por tenant) y en una cache del contenedor.
+ALFA_TIEMPO_COCINA = float(os.getenv("ALFA_TIEMPO_COCINA", "0.1"))
+TIEMPO_COCINA_DEFECTO_S = float(os.getenv("TIEMPO_COCINA_DEFECTO_S", "900"))
+CAPACIDAD_COCINA = int(os.getenv("CAPACIDAD_COCINA", "3"))
+CACHE_MODELO_TTL_S = float(os.getenv("CACHE_MODELO_TTL_S", "30"))
+MAX_INTENTOS_MODELO = 2
+
+# tenant_id -> (modelo, expira_en)
+cache_modelo_cocina = {}
+
+
+def modelo_vacio(tenant_id):
+    return {"tenant_id": tenant_id, "promedio_s": 0.0, "varianza_s": 0.0, "muestras": 0, "version": 0}
+
+
+def obtener_modelo_cocina(tenant_id, context, usar_cache=True, afecta_circuito=True):
+    if usar_cache:
+        en_cache = cache_modelo_cocina.get(tenant_id)
+        if en_cache and en_cache[1] > time.monotonic():
+            return en_cache[0]
+
+    resp = llamar_aws(tabla_tiempos_cocina.get_item, context, afecta_circuito=afecta_circuito,
+                      Key={"tenant_id": tenant_id})
+    item = resp.get("Item")
+    if item:
+        modelo = {
+            "tenant_id": tenant_id,
+            "promedio_s": float(item.get("promedio_s", 0)),
+            "varianza_s": float(item.get("varianza_s", 0)),
+            "muestras": int(item.get("muestras", 0)),
+            "version": int(item.get("version", 0))
+        }
+    else:
+        modelo = modelo_vacio(tenant_id)
+    cache_modelo_cocina[tenant_id] = (modelo, time.monotonic() + CACHE_MODELO_TTL_S)
+    return modelo
+
+
+def actualizar_modelo(modelo, duracion_s):
+    """
+    Actualización O(1) de media y varianza exponenciales.
+    Con pocas muestras usa alfa = 1/n (media simple) para que el arranque no dependa
+    del primer valor.
+    """
+    n = modelo["muestras"] + 1
+    alfa = max(ALFA_TIEMPO_COCINA, 1.0 / n)
+    diferencia = duracion_s - modelo["promedio_s"]
+    incremento = alfa * diferencia
+    return {
+        "tenant_id": modelo["tenant_id"],
+        "promedio_s": modelo["promedio_s"] + incremento,
+        "varianza_s": (1 - alfa) * (modelo["varianza_s"] + diferencia * incremento),
+        "muestras": n,
+        "version": modelo["version"] + 1
+    }
+
+
+def registrar_tiempos_cocina(tenant_id, items_cocina, context):
+    """
+    Se llama con los pedidos de un tenant que terminaron COCINA y ya pasaron a
+    empaquetamiento en PEDIDOS, y solo con los que esta invocación cerró (items de
+    COCINA con hora_comienzo y hora_fin): una reentrega no vuelve a contar el mismo pedido.
+    Aplica todas las muestras al modelo en memoria y escribe una sola vez, así un
+    sobre de 100 pedidos no hace 100 escrituras sobre el mismo item del tenant.
+    Escritura optimista: condiciona por version y, si otro contenedor ganó, relee y reintenta.
+    Sus llamadas no afectan el circuito y un fallo solo se loguea.
+    """
+    duraciones = []
+    for item in items_cocina:
+        duracion_s = segundos_entre(item.get("hora_comienzo"), item.get("hora_fin"))
+        if duracion_s is not None and duracion_s >= 0:
+            duraciones.append(duracion_s)
+    if not duraciones:
+        return
+
+    try:
+        modelo = obtener_modelo_cocina(tenant_id, context, afecta_circuito=False)
+        for _ in range(MAX_INTENTOS_MODELO):
+            nuevo = modelo
+            for duracion_s in duraciones:
+                nuevo = actualizar_modelo(nuevo, duracion_s)
+            try:
+                llamar_aws(tabla_tiempos_cocina.update_item, context, afecta_circuito=False,
+                    Key={"tenant_id": tenant_id},
+                    UpdateExpression="SET promedio_s = :p, varianza_s = :v, muestras = :n, "
+                                     "version = :nv, actualizado = :a",
+                    ConditionExpression="attribute_not_exists(tenant_id) OR version = :va",
+                    ExpressionAttributeValues={
+                        ":p": Decimal(str(round(nuevo["promedio_s"], 3))),
+                        ":v": Decimal(str(round(nuevo["varianza_s"], 3))),
+                        ":n": nuevo["muestras"],
+                        ":nv": nuevo["version"],
+                        ":va": modelo["version"],
+                        ":a": obtener_timestamp_iso()
+                    }
+                )
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise
+                modelo = obtener_modelo_cocina(tenant_id, context, usar_cache=False, afecta_circuito=False)
+                continue
+            cache_modelo_cocina[tenant_id] = (nuevo, time.monotonic() + CACHE_MODELO_TTL_S)
+            return
+        print("WARN modelo cocina: demasiados conflictos de version para", tenant_id)
+    except ERRORES_AWS as e:
+        print("ERROR actualizando modelo de tiempos de cocina:", repr(e))
+
+
+def estimar_cola_cocina(en_curso, pendientes, promedio_s, ahora):
+    """
+    en_curso: [(pedido, hora_comienzo_iso)] ya ordenados por hora_comienzo
+    pendientes: [pedido] en el orden en que deben entrar a cocina
+    Simula CAPACIDAD_COCINA puestos: cada pendiente toma el primer puesto que se libera.
+    Devuelve [(pedido, estado, hora_comienzo, eta_s)].
+    """
+    cola = []
+    puestos = []
+    for pedido, hora_comienzo in en_curso:
+        transcurrido = segundos_entre(hora_comienzo, ahora) or 0.0
+        eta_s = max(0.0, promedio_s - transcurrido)
+        puestos.append(eta_s)
+        cola.append((pedido, "cocina", hora_comienzo, eta_s))
+
+    puestos.extend([0.0] * max(0, CAPACIDAD_COCINA - len(puestos)))
+    heapq.heapify(puestos)
+    for pedido in pendientes:
+        inicio_s = heapq.heappop(puestos)
+        eta_s = inicio_s + promedio_s
+        heapq.heappush(puestos, eta_s)
+        cola.append((pedido, "pagado", None, eta_s))
+    return cola
+
+
+# ------------------------- Procesamiento de sobres con varios pedidos ------------------------- #
+
+MAX_INTENTOS_LOTE = int(os.getenv("MAX_INTENTOS_LOTE", "5"))
+LOTE_ESCRITURA_DYNAMO = 25  # límite de BatchWriteItem
+MAX_VUELTAS_NO_PROCESADOS = 4
+BACKOFF_NO_PROCESADOS_S = 0.1
+BACKOFF_REENCOLADO_S = float(os.getenv("BACKOFF_REENCOLADO_S", "1"))
+# Cola donde terminan los pedidos de un sobre que no se pudieron procesar
+COLA_PEDIDOS_FALLIDOS_URL = os.getenv("COLA_PEDIDOS_FALLIDOS_URL")
+
+
+def esperar_con_backoff(base_s, vuelta, context):
+    """
+    Backoff exponencial con jitter completo: espera entre 0 y base_s * 2^vuelta.
+    Devuelve False (sin esperar) si la espera no cabe en el tiempo que le queda a la Lambda.
+    """
+    espera_s = random.uniform(0, base_s * 2 ** vuelta)
+    if context is not None:
+        disponible_s = (context.get_remaining_time_in_millis() - MARGEN_DEADLINE_MS) / 1000.0
+        if espera_s >= disponible_s:
+            return False
+    time.sleep(espera_s)
+    return True
+
+
+def esperar_no_procesados(vuelta, context):
+    # Unprocessed* casi siempre es throttling: se espera antes de la vuelta siguiente
+    return esperar_con_backoff(BACKOFF_NO_PROCESADOS_S, vuelta, context)
+
+
+LOTE_LECTURA_DYNAMO = 100  # límite de BatchGetItem
+
+
+def leer_items_lote(tabla, ids, clave_de, campo_id, context):
+    """
+    BatchGetItem sobre cualquier tabla, en bloques de 100 y con backoff para
+    UnprocessedKeys.
+      - clave_de(id) arma la Key de DynamoDB
+      - campo_id es el atributo que identifica al item (en la Key y en el item)
+    Devuelve ({id: item}, {ids que DynamoDB dejó sin procesar tras las vueltas}).
+    """
+    encontrados = {}
+    no_leidos = set()
+    for inicio in range(0, len(ids), LOTE_LECTURA_DYNAMO):
+        pendientes = {"Keys": [clave_de(i) for i in ids[inicio:inicio + LOTE_LECTURA_DYNAMO]]}
+        for vuelta in range(MAX_VUELTAS_NO_PROCESADOS):
+            if vuelta and not esperar_no_procesados(vuelta, context):
+                break
+            resp = llamar_aws(dynamodb.batch_get_item, context,
+                              RequestItems={tabla.name: pendientes})
+            for item in resp.get("Responses", {}).get(tabla.name, []):
+                encontrados[item[campo_id]] = item
+            pendientes = resp.get("UnprocessedKeys", {}).get(tabla.name)
+            if not pendientes:
+                break
+        if pendientes:
+            no_leidos.update(k[campo_id] for k in pendientes["Keys"])
+    return encontrados, no_leidos
+
+
+def leer_pedidos_lote(tenant_id, ids_pedido, context):
+    return leer_items_lote(tabla_pedidos, ids_pedido,
+                           lambda i: {"tenant_id": tenant_id, "id": i}, "id", context)
+
+
+def escribir_items_lote(tabla, items, context):
+    """
+    BatchWriteItem (PutRequest) en bloques de 25.
+    Devuelve el conjunto de id_pedido que DynamoDB dejó sin escribir.
+    """
+    no_escritos = set()
+    for inicio in range(0, len(items), LOTE_ESCRITURA_DYNAMO):
+        pendientes = [{"PutRequest": {"Item": item}}
+                      for item in items[inicio:inicio + LOTE_ESCRITURA_DYNAMO]]
+        for vuelta in range(MAX_VUELTAS_NO_PROCESADOS):
+            if vuelta and not esperar_no_procesados(vuelta, context):
+                break
+            resp = llamar_aws(dynamodb.batch_write_item, context,
+                              RequestItems={tabla.name: pendientes})
+            pendientes = resp.get("UnprocessedItems", {}).get(tabla.name)
+            if not pendientes:
+                break
+        if pendientes:
+            no_escritos.update(p["PutRequest"]["Item"]["id_pedido"] for p in pendientes)
+    return no_escritos
+
+
+def url_cola_desde_arn(arn):
+    # arn:aws:sqs:<region>:<cuenta>:<nombre>
+    _, _, _, region, cuenta, nombre = arn.split(":", 5)
+    return f"https://sqs.{region}.amazonaws.com/{cuenta}/{nombre}"
+
+
+def enviar_sobre(url_cola, lote, pedidos, context, **extra):
+    cuerpo = {k: v for k, v in lote.cuerpo.items() if k != "pedidos"}
+    cuerpo.update(extra)
+    cuerpo["pedidos"] = pedidos
+
+    mensaje = {
+        "QueueUrl": url_cola,
+        "MessageBody": json.dumps(cuerpo, default=decimal_default)
+    }
+    if url_cola.endswith(".fifo"):
+        mensaje["MessageGroupId"] = lote.tenant_id
+    llamar_aws(sqs_client.send_message, context, **mensaje)
+
+
+def reencolar_pedidos(lote, solicitudes, context):
+    """
+    Vuelve a enviar a la cola de origen un sobre solo con los pedidos que fallaron
+    de forma transitoria. Devuelve False si ya se agotaron los intentos.
+    Las colas son FIFO y no aceptan DelaySeconds por mensaje, así que el backoff
+    (BACKOFF_REENCOLADO_S * 2^intento, con jitter) se espera aquí antes de enviar.
+    El camino de un solo pedido, en cambio, reintenta tras el VisibilityTimeout
+    hasta el maxReceiveCount de la cola.
+    """
+    if lote.intento + 1 >= MAX_INTENTOS_LOTE or not lote.origen_arn:
+        return False
+
+    esperar_con_backoff(BACKOFF_REENCOLADO_S, lote.intento, context)
+    enviar_sobre(url_cola_desde_arn(lote.origen_arn), lote, [s.fuentes[0] for s in solicitudes],
+                 context, intento=lote.intento + 1)
+    return True
+
+
+def enviar_a_fallidos(lote, fallidos, transicion, context):
+    """
+    Envía a COLA_PEDIDOS_FALLIDOS_URL un sobre con los pedidos que no se pudieron
+    procesar (error no transitorio o intentos agotados), cada uno con su detalle,
+    para revisarlos o re-enviarlos a mano. Devuelve False si la cola no está configurada.
+    """
+    if not COLA_PEDIDOS_FALLIDOS_URL:
+        print("ERROR COLA_PEDIDOS_FALLIDOS_URL no configurada, los pedidos fallidos solo quedan en el log")
+        return False
+    enviar_sobre(COLA_PEDIDOS_FALLIDOS_URL, lote,
+                 [{"pedido": s.fuentes[0], "detalle": detalle} for s, detalle in fallidos],
+                 context, intento=lote.intento, transicion=transicion)
+    return True
+
+
+def procesar_lote(lote, context, estado_esperado, estado_nuevo, campo_token,
+                  crear_item, tabla_nueva, tabla_anterior=None, al_cerrar_anterior=None):
+    """
+    Aplica la transición estado_esperado -> estado_nuevo a todos los pedidos del sobre:
+      1) Lee los pedidos con BatchGetItem
+      2) Cierra la etapa anterior (hora_fin, status='terminado') si sigue abierta
+      3) Crea los registros de la nueva etapa con BatchWriteItem
+      4) Actualiza PEDIDOS.estado_pedido (condicionado al estado esperado)
+      5) Llama una sola vez a al_cerrar_anterior(tenant_id, items_cerrados, context)
+         con los pedidos que avanzaron y cuya etapa anterior se cerró en esta invocación
+    Los pedidos con fallos transitorios se re-encolan en un nuevo sobre. Los que
+    fallaron de forma definitiva (error no transitorio o intentos agotados) se loguean
+    uno por uno y se envían a COLA_PEDIDOS_FALLIDOS_URL.
+    Si no se pudo enviar a SQS, se relanza para que SQS reentregue el mensaje
+    completo: los pedidos ya procesados se descartan por el chequeo de estado.
+    """
+    transicion = f"{estado_esperado} -> {estado_nuevo}"
+    resultados = []
+    a_reintentar = []
+    fallidos = []   # [(solicitud, detalle)]
+
+    def id_de(solicitud):
+        return solicitud.get("id_pedido") or solicitud.get("id")
+
+    def registrar(id_pedido, resultado, detalle=None):
+        r = {"id_pedido": id_pedido, "resultado": resultado}
+        if detalle:
+            r["detalle"] = detalle
+        resultados.append(r)
+
+    def fallo(solicitud, error):
+        if es_error_transitorio(error):
+            a_reintentar.append(solicitud)
+        else:
+            registrar(id_de(solicitud), "error", str(error))
+            fallidos.append((solicitud, str(error)))
+
+    for id_pedido, detalle in lote.invalidos:
+        registrar(id_pedido, "invalido", detalle)
+
+    # 1) Leer pedidos
+    candidatos = []
+    try:
+        pedidos, no_leidos = leer_pedidos_lote(lote.tenant_id, [id_de(s) for s in lote.pedidos], context)
+    except ERRORES_AWS as e:
+        for solicitud in lote.pedidos:
+            fallo(solicitud, e)
+    else:
+        for solicitud in lote.pedidos:
+            id_pedido = id_de(solicitud)
+            pedido = pedidos.get(id_pedido)
+            if id_pedido in no_leidos:
+                a_reintentar.append(solicitud)
+            elif not pedido:
+                registrar(id_pedido, "no_encontrado")
+            elif pedido.get("estado_pedido") != estado_esperado:
+                registrar(id_pedido, "estado_invalido",
+                          f"Estado actual '{pedido.get('estado_pedido')}', se esperaba '{estado_esperado}'")
+            else:
+                candidatos.append((solicitud, pedido))
+
+    # 2) Cerrar etapa anterior
+    abiertos = []
+    for solicitud, pedido in candidatos:
+        item_cerrado = None
+        if tabla_anterior is not None:
+            try:
+                item_cerrado = cerrar_etapa(tabla_anterior, pedido["id"], context)
+            except ERRORES_AWS as e:
+                fallo(solicitud, e)
+                continue
+        abiertos.append((solicitud, pedido, crear_item(solicitud, pedido), item_cerrado))
+
+    # 3) Crear registros de la nueva etapa
+    try:
+        no_escritos = escribir_items_lote(tabla_nueva, [item for _, _, item, _ in abiertos], context)
+    except ERRORES_AWS as e:
+        for solicitud, _, _, _ in abiertos:
+            fallo(solicitud, e)
+        abiertos = []
+        no_escritos = set()
+
+    # 4) Actualizar estado en PEDIDOS
+    items_cerrados = []
+    for solicitud, pedido, _, item_cerrado in abiertos:
+        if pedido["id"] in no_escritos:
+            a_reintentar.append(solicitud)
+            continue
+
+        update_expr = "SET estado_pedido = :e"
+        expr_values = {":e": estado_nuevo, ":anterior": estado_esperado}
+        task_token = solicitud.get("taskToken")
+        if task_token:
+            update_expr += f", {campo_token} = :t"
+            expr_values[":t"] = task_token
+
+        try:
+            llamar_aws(tabla_pedidos.update_item, context,
+                Key={
+                    "tenant_id": pedido["tenant_id"],
+                    "id": pedido["id"]
+                },
+                UpdateExpression=update_expr,
+                ConditionExpression="estado_pedido = :anterior",
+                ExpressionAttributeValues=expr_values
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                registrar(pedido["id"], "estado_invalido", "El pedido cambió de estado durante el proceso")
+            else:
+                fallo(solicitud, e)
+            continue
+        except ERRORES_AWS as e:
+            fallo(solicitud, e)
+            continue
+        registrar(pedido["id"], "ok")
+        if item_cerrado:
+            items_cerrados.append(item_cerrado)
+
+    # 5) Etapa anterior cerrada (ej. modelo de tiempos de cocina)
+    if al_cerrar_anterior and items_cerrados:
+        al_cerrar_anterior(lote.tenant_id, items_cerrados, context)
+
+    # 6) Re-encolar solo los pedidos con fallos transitorios
+    reencolado = False
+    if a_reintentar:
+        try:
+            reencolado = reencolar_pedidos(lote, a_reintentar, context)
+        except ERRORES_AWS as e:
+            print("ERROR re-encolando pedidos, se devuelve el mensaje completo a SQS:", repr(e))
+            raise
+        for solicitud in a_reintentar:
+            if reencolado:
+                registrar(id_de(solicitud), "reencolado")
+            else:
+                detalle = f"Se agotaron los intentos del sobre ({MAX_INTENTOS_LOTE})"
+                registrar(id_de(solicitud), "error", detalle)
+                fallidos.append((solicitud, detalle))
+
+    # 7) Pedidos fallidos: log por pedido y cola de fallidos
+    enviados_a_fallidos = False
+    if fallidos:
+        for solicitud, detalle in fallidos:
+            print(f"ERROR lote {transicion}: pedido {id_de(solicitud)} del tenant {lote.tenant_id} "
+                  f"no procesado (intento {lote.intento}): {detalle}")
+        try:
+            enviados_a_fallidos = enviar_a_fallidos(lote, fallidos, transicion, context)
+        except ERRORES_AWS as e:
+            print("ERROR enviando pedidos a la cola de fallidos, se devuelve el mensaje completo a SQS:",
+                  repr(e))
+            raise
+
+    exitosos = sum(1 for r in resultados if r["resultado"] == "ok")
+    print(f"DEBUG lote {transicion}: {exitosos}/{len(resultados)} ok, "
+          f"{len(a_reintentar)} a reintentar, {len(fallidos)} fallidos (intento {lote.intento})")
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({
+            "mensaje": f"Lote {transicion} procesado",
+            "tenant_id": lote.tenant_id,
+            "intento": lote.intento,
+            "cantidad": len(resultados),
+            "exitosos": exitosos,
+            "reencolados": len(a_reintentar) if reencolado else 0,
+            "enviados_a_fallidos": len(fallidos) if enviados_a_fallidos else 0,
+            "resultados": resultados
+        })
+    }
+
+
 # ------------------------- Lambda 1: pagado -> cocina ------------------------- #
 
+@con_proteccion_aws
 def pagado_a_cocina(event, context):
     """
     Transición:
@@ -151,27 +1114,26 @@ def pagado_a_cocina(event, context):
       - Crea registro en COCINA (status = 'cocinando')
       - Actualiza PEDIDOS.estado_pedido = 'cocina'
       - Si viene de Step Functions, guarda task_token_cocina
+      - Si el mensaje SQS trae un sobre con varios pedidos, los procesa en lote (procesar_lote)
     """
-    event = parse_event(event)
+    event, error = parse_event(event, ESQUEMA_TRANSICION)
+    if error:
+        return error
+    if isinstance(event, Lote):
+        return procesar_lote(event, context, "pagado", "cocina", "task_token_cocina",
+                             crear_item=crear_item_cocina, tabla_nueva=tabla_cocina)
 
-    pedido, error = validar_pedido_y_estado(event, "pagado")
+    pedido, error = validar_pedido_y_estado(event, "pagado", context)
     if error:
         return error
 
     tenant_id = pedido["tenant_id"]
     id_pedido = pedido["id"]
-    id_empleado = event.get("id_empleado")
     task_token = event.get("taskToken")
 
     # 1) Crear registro en COCINA
-    item_cocina = {
-        "id_pedido": id_pedido,
-        "id_empleado": id_empleado or "no_asignado",
-        "hora_comienzo": obtener_timestamp_iso(),
-        "hora_fin": None,
-        "status": "cocinando"
-    }
-    tabla_cocina.put_item(Item=item_cocina)
+    item_cocina = crear_item_cocina(event, pedido)
+    llamar_aws(tabla_cocina.put_item, context, Item=item_cocina)
 
     # 2) Actualizar estado del pedido a 'cocina' + token si aplica
     update_expr = "SET estado_pedido = :e"
@@ -181,7 +1143,7 @@ def pagado_a_cocina(event, context):
         update_expr += ", task_token_cocina = :t"
         expr_values[":t"] = task_token
 
-    tabla_pedidos.update_item(
+    llamar_aws(tabla_pedidos.update_item, context,
         Key={
             "tenant_id": tenant_id,
             "id": id_pedido
@@ -206,46 +1168,40 @@ def pagado_a_cocina(event, context):
 
 # ------------------------- Lambda 2: cocina -> empaquetamiento ------------------------- #
 
+@con_proteccion_aws
 def cocina_a_empaquetamiento(event, context):
     """
     Transición:
       cocina -> empaquetamiento
-      - Actualiza COCINA (status = 'terminado')
+      - Actualiza COCINA (status = 'terminado') y el modelo de tiempos de cocina del tenant
       - Crea registro en DESPACHADOR (empaquetamiento, status='cocinando')
       - Actualiza PEDIDOS.estado_pedido = 'empaquetamiento'
       - Guarda task_token_empaquetamiento si viene de Step Functions
+      - Si el mensaje SQS trae un sobre con varios pedidos, los procesa en lote (procesar_lote)
     """
-    event = parse_event(event)
+    event, error = parse_event(event, ESQUEMA_TRANSICION)
+    if error:
+        return error
+    if isinstance(event, Lote):
+        return procesar_lote(event, context, "cocina", "empaquetamiento", "task_token_empaquetamiento",
+                             crear_item=crear_item_despachador, tabla_nueva=tabla_despachador,
+                             tabla_anterior=tabla_cocina,
+                             al_cerrar_anterior=registrar_tiempos_cocina)
 
-    pedido, error = validar_pedido_y_estado(event, "cocina")
+    pedido, error = validar_pedido_y_estado(event, "cocina", context)
     if error:
         return error
 
     tenant_id = pedido["tenant_id"]
     id_pedido = pedido["id"]
-    id_empleado_despachador = event.get("id_empleado")
     task_token = event.get("taskToken")
 
-    # 1) Terminar COCINA
-    tabla_cocina.update_item(
-        Key={"id_pedido": id_pedido},
-        UpdateExpression="SET hora_fin = :hf, #st = :s",
-        ExpressionAttributeNames={"#st": "status"},
-        ExpressionAttributeValues={
-            ":hf": obtener_timestamp_iso(),
-            ":s": "terminado"
-        }
-    )
+    # 1) Terminar COCINA (None si ya estaba cerrada por un intento anterior)
+    item_cocina_cerrado = cerrar_etapa(tabla_cocina, id_pedido, context)
 
     # 2) Crear registro en DESPACHADOR (empaquetamiento)
-    item_despachador = {
-        "id_pedido": id_pedido,
-        "id_empleado": id_empleado_despachador or "no_asignado",
-        "hora_comienzo": obtener_timestamp_iso(),
-        "hora_fin": None,
-        "status": "cocinando"  # puedes cambiar el texto a 'empaquetando' si quieres
-    }
-    tabla_despachador.put_item(Item=item_despachador)
+    item_despachador = crear_item_despachador(event, pedido)
+    llamar_aws(tabla_despachador.put_item, context, Item=item_despachador)
 
     # 3) Actualizar estado del pedido a 'empaquetamiento' + token
     update_expr = "SET estado_pedido = :e"
@@ -255,7 +1211,7 @@ def cocina_a_empaquetamiento(event, context):
         update_expr += ", task_token_empaquetamiento = :t"
         expr_values[":t"] = task_token
 
-    tabla_pedidos.update_item(
+    llamar_aws(tabla_pedidos.update_item, context,
         Key={
             "tenant_id": tenant_id,
             "id": id_pedido
@@ -264,6 +1220,10 @@ def cocina_a_empaquetamiento(event, context):
         ExpressionAttributeValues=expr_values
     )
 
+    # 4) Modelo de tiempos: solo con la transición completa y COCINA cerrada aquí
+    if item_cocina_cerrado:
+        registrar_tiempos_cocina(tenant_id, [item_cocina_cerrado], context)
+
     return {
         "statusCode": 200,
         "body": json.dumps({
@@ -286,6 +1246,7 @@ def cocina_a_empaquetamiento(event, context):
 
 # ------------------------- Lambda 3: empaquetamiento -> delivery ------------------------- #
 
+@con_proteccion_aws
 def empaquetamiento_a_delivery(event, context):
     """
     Transición:
@@ -294,44 +1255,30 @@ def empaquetamiento_a_delivery(event, context):
       - Crea registro en DELIVERY (status='en camino')
       - Actualiza PEDIDOS.estado_pedido = 'delivery'
       - Guarda task_token_delivery si viene de Step Functions
+      - Si el mensaje SQS trae un sobre con varios pedidos, los procesa en lote (procesar_lote)
     """
-    event = parse_event(event)
+    event, error = parse_event(event, ESQUEMA_TRANSICION)
+    if error:
+        return error
+    if isinstance(event, Lote):
+        return procesar_lote(event, context, "empaquetamiento", "delivery", "task_token_delivery",
+                             crear_item=crear_item_delivery, tabla_nueva=tabla_delivery,
+                             tabla_anterior=tabla_despachador)
 
-    pedido, error = validar_pedido_y_estado(event, "empaquetamiento")
+    pedido, error = validar_pedido_y_estado(event, "empaquetamiento", context)
     if error:
         return error
 
     tenant_id = pedido["tenant_id"]
     id_pedido = pedido["id"]
-
-    repartidor = event.get("repartidor")
-    id_repartidor = event.get("id_repartidor")
-    origen = event.get("origen")
-    destino = event.get("destino")
     task_token = event.get("taskToken")
 
-    # 1) Terminar empaquetamiento (DESPACHADOR)
-    tabla_despachador.update_item(
-        Key={"id_pedido": id_pedido},
-        UpdateExpression="SET hora_fin = :hf, #st = :s",
-        ExpressionAttributeNames={"#st": "status"},
-        ExpressionAttributeValues={
-            ":hf": obtener_timestamp_iso(),
-            ":s": "terminado"
-        }
-    )
+    # 1) Terminar empaquetamiento (DESPACHADOR), si sigue abierto
+    cerrar_etapa(tabla_despachador, id_pedido, context)
 
     # 2) Crear registro en DELIVERY
-    item_delivery = {
-        "id_pedido": id_pedido,
-        "tenant_id": tenant_id,
-        "repartidor": repartidor or "no_asignado",
-        "id_repartidor": id_repartidor or "no_asignado",
-        "origen": origen or "no_definido",
-        "destino": destino or "no_definido",
-        "status": "en camino"
-    }
-    tabla_delivery.put_item(Item=item_delivery)
+    item_delivery = crear_item_delivery(event, pedido)
+    llamar_aws(tabla_delivery.put_item, context, Item=item_delivery)
 
     # 3) Actualizar estado del pedido a 'delivery' + token
     update_expr = "SET estado_pedido = :e"
@@ -341,7 +1288,7 @@ def empaquetamiento_a_delivery(event, context):
         update_expr += ", task_token_delivery = :t"
         expr_values[":t"] = task_token
 
-    tabla_pedidos.update_item(
+    llamar_aws(tabla_pedidos.update_item, context,
         Key={
             "tenant_id": tenant_id,
             "id": id_pedido
@@ -372,6 +1319,7 @@ def empaquetamiento_a_delivery(event, context):
 
 # ------------------------- Lambda 4: delivery -> entregado ------------------------- #
 
+@con_proteccion_aws
 def delivery_a_entregado(event, context):
     """
     Transición final:
@@ -381,9 +1329,11 @@ def delivery_a_entregado(event, context):
       (se ejecuta automáticamente cuando Step Functions pasa a este estado,
        después de que confirmes 'delivery-entregado' vía confirmar_paso)
     """
-    event = parse_event(event)
+    event, error = parse_event(event, ESQUEMA_TRANSICION)
+    if error:
+        return error
 
-    pedido, error = validar_pedido_y_estado(event, "delivery")
+    pedido, error = validar_pedido_y_estado(event, "delivery", context)
     if error:
         return error
 
@@ -391,7 +1341,7 @@ def delivery_a_entregado(event, context):
     id_pedido = pedido["id"]
 
     # 1) Actualizar DELIVERY
-    tabla_delivery.update_item(
+    llamar_aws(tabla_delivery.update_item, context,
         Key={"id_pedido": id_pedido},
         UpdateExpression="SET #st = :s",
         ExpressionAttributeNames={"#st": "status"},
@@ -399,7 +1349,7 @@ def delivery_a_entregado(event, context):
     )
 
     # 2) Actualizar estado en PEDIDOS
-    tabla_pedidos.update_item(
+    llamar_aws(tabla_pedidos.update_item, context,
         Key={
             "tenant_id": tenant_id,
             "id": id_pedido
@@ -424,6 +1374,7 @@ def delivery_a_entregado(event, context):
     }
 
 
+@con_proteccion_aws
 def obtener_pedido(event, context):
     """
     GET /pedidos/{id_pedido}?tenant_id=TENANT
@@ -432,26 +1383,22 @@ def obtener_pedido(event, context):
 
     print("DEBUG obtener_pedido raw event:", json.dumps(event))
 
-    event = parse_event(event)
+    event, error = parse_event(event, ESQUEMA_OBTENER_PEDIDO)
+    if error:
+        return error
 
     id_pedido = event.get("id_pedido") or event.get("path_id_pedido")
     tenant_id = event.get("tenant_id")
 
-    if not id_pedido or not tenant_id:
-        return {
-            "statusCode": 400,
-            "body": json.dumps({
-                "mensaje": "Falta tenant_id o id_pedido"
-            })
-        }
-
     # 1. Obtener PEDIDO
     try:
-        pedido_resp = tabla_pedidos.get_item(
+        pedido_resp = llamar_aws(tabla_pedidos.get_item, context,
             Key={"tenant_id": tenant_id, "id": id_pedido}
         )
         pedido = pedido_resp.get("Item")
     except Exception as e:
+        if es_error_transitorio(e):
+            raise  # con_proteccion_aws responde 503
         return {
             "statusCode": 500,
             "body": json.dumps({"mensaje": "Error leyendo pedido", "detalle": str(e)})
@@ -464,15 +1411,15 @@ def obtener_pedido(event, context):
         }
 
     # 2. Obtener COCINA
-    cocina_resp = tabla_cocina.get_item(Key={"id_pedido": id_pedido})
+    cocina_resp = llamar_aws(tabla_cocina.get_item, context, Key={"id_pedido": id_pedido})
     cocina = cocina_resp.get("Item", {})
 
     # 3. Obtener EMPAQUETAMIENTO
-    des_resp = tabla_despachador.get_item(Key={"id_pedido": id_pedido})
+    des_resp = llamar_aws(tabla_despachador.get_item, context, Key={"id_pedido": id_pedido})
     despachador = des_resp.get("Item", {})
 
     # 4. Obtener DELIVERY
-    delivery_resp = tabla_delivery.get_item(Key={"id_pedido": id_pedido})
+    delivery_resp = llamar_aws(tabla_delivery.get_item, context, Key={"id_pedido": id_pedido})
     delivery = delivery_resp.get("Item", {})
 
     return {
@@ -488,6 +1435,7 @@ def obtener_pedido(event, context):
 
 
 
+@con_proteccion_aws
 def listar_pedidos(event, context):
     """
     GET /pedidos?tenant_id=X&estado=cocina,delivery
@@ -496,19 +1444,13 @@ def listar_pedidos(event, context):
 
     print("DEBUG listar_pedidos raw event:", json.dumps(event))
 
-    event = parse_event(event)
+    event, error = parse_event(event, ESQUEMA_LISTAR_PEDIDOS)
+    if error:
+        return error
 
     tenant_id = event.get("tenant_id")
     estados_raw = event.get("estado")  # puede ser "cocina", "cocina,delivery", etc.
 
-    if not tenant_id or not estados_raw:
-        return {
-            "statusCode": 400,
-            "body": json.dumps({
-                "mensaje": "Debe enviar tenant_id y estado (uno o varios separados por coma)."
-            })
-        }
-
     # Procesar lista de estados
     lista_estados = [e.strip() for e in estados_raw.split(",") if e.strip()]
 
@@ -518,7 +1460,7 @@ def listar_pedidos(event, context):
 
     try:
         # Query por tenant_id
-        resp = tabla_pedidos.query(
+        resp = llamar_aws(tabla_pedidos.query, context,
             KeyConditionExpression=Key("tenant_id").eq(tenant_id)
         )
         items = resp.get("Items", [])
@@ -529,6 +1471,8 @@ def listar_pedidos(event, context):
                 pedidos_finales.append(item)
 
     except Exception as e:
+        if es_error_transitorio(e):
+            raise  # con_proteccion_aws responde 503
         return {
             "statusCode": 500,
             "body": json.dumps({
@@ -548,8 +1492,100 @@ def listar_pedidos(event, context):
     }
 
 
+@con_proteccion_aws
+def cola_cocina(event, context):
+    """
+    GET /cocina/cola?tenant_id=X
+    Devuelve la cola de cocina del tenant:
+      - pedidos en 'cocina' ordenados por hora_comienzo
+      - luego los 'pagado' que aún no entran a cocina, ordenados por id_pedido
+        (clave de rango de PEDIDOS; el pedido no guarda una hora de pago)
+    con un ETA (segundos y hora estimada) calculado con el modelo de tiempos del tenant.
+    """
+    event, error = parse_event(event, ESQUEMA_COLA_COCINA)
+    if error:
+        return error
+
+    tenant_id = event.get("tenant_id")
+
+    # Los errores de AWS los maneja con_proteccion_aws (503)
+
+    # 1) Pedidos pagados o en cocina del tenant
+    pedidos = []
+    consulta = {
+        "KeyConditionExpression": Key("tenant_id").eq(tenant_id),
+        "FilterExpression": Attr("estado_pedido").is_in(["pagado", "cocina"])
+    }
+    while True:
+        resp = llamar_aws(tabla_pedidos.query, context, **consulta)
+        pedidos.extend(resp.get("Items", []))
+        if "LastEvaluatedKey" not in resp:
+            break
+        consulta["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+    # 2) Registros de COCINA de los que están en curso
+    ids_en_curso = [p["id"] for p in pedidos if p.get("estado_pedido") == "cocina"]
+    registros_cocina, no_leidos = leer_items_lote(
+        tabla_cocina, ids_en_curso, lambda i: {"id_pedido": i}, "id_pedido", context)
+    if no_leidos:
+        # Sin hora_comienzo la posición y el ETA de esos pedidos serían inventados
+        return {
+            "statusCode": 503,
+            "body": json.dumps({
+                "mensaje": "No se pudieron leer todos los registros de COCINA, reintente más tarde",
+                "pedidos_sin_leer": sorted(no_leidos)
+            })
+        }
+
+    # 3) Modelo de tiempos (cache del contenedor o TIEMPOS_COCINA)
+    modelo = obtener_modelo_cocina(tenant_id, context)
+
+    promedio_s = modelo["promedio_s"] if modelo["muestras"] else TIEMPO_COCINA_DEFECTO_S
+
+    ahora = obtener_timestamp_iso()
+    # Un pedido en 'cocina' sin registro en COCINA se trata como recién empezado
+    en_curso = sorted(
+        ((p, registros_cocina.get(p["id"], {}).get("hora_comienzo") or ahora)
+         for p in pedidos if p.get("estado_pedido") == "cocina"),
+        key=lambda par: par[1]
+    )
+    # Orden de la query: clave de rango 'id' (no es orden de llegada)
+    pendientes = [p for p in pedidos if p.get("estado_pedido") == "pagado"]
+
+    ahora_dt = datetime.fromisoformat(ahora)
+    cola = []
+    for posicion, (pedido, estado, hora_comienzo, eta_s) in enumerate(
+            estimar_cola_cocina(en_curso, pendientes, promedio_s, ahora), start=1):
+        cola.append({
+            "posicion": posicion,
+            "id_pedido": pedido["id"],
+            "estado_pedido": estado,
+            "hora_comienzo": hora_comienzo,
+            "id_empleado": registros_cocina.get(pedido["id"], {}).get("id_empleado"),
+            "eta_segundos": round(eta_s),
+            "hora_estimada_fin": (ahora_dt + timedelta(seconds=eta_s)).isoformat()
+        })
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({
+            "tenant_id": tenant_id,
+            "en_cocina": len(en_curso),
+            "pendientes": len(pendientes),
+            "orden_pendientes": "id_pedido",
+            "modelo": {
+                "promedio_segundos": round(promedio_s),
+                "desviacion_segundos": round(modelo["varianza_s"] ** 0.5),
+                "muestras": modelo["muestras"],
+                "capacidad": CAPACIDAD_COCINA
+            },
+            "cola": cola
+        }, default=decimal_default)
+    }
+
 
 # ------------------------- Lambda de callback: confirmar_paso ------------------------- #
+@con_proteccion_aws
 def confirmar_paso(event, context):
     """
     Lambda de callback para avanzar el Step Function.
@@ -562,8 +1598,10 @@ def confirmar_paso(event, context):
     # Para ver exactamente qué llega desde API Gateway
     print("DEBUG raw event:", json.dumps(event))
 
-    event = parse_event(event)
-    print("DEBUG parsed event:", json.dumps(event))
+    event, error = parse_event(event, ESQUEMA_CONFIRMAR_PASO)
+    if error:
+        return error
+    print("DEBUG parsed event:", json.dumps(event.a_dict()))
 
     tenant_id = event.get("tenant_id")
     id_pedido = event.get("id_pedido") or event.get("id")
@@ -575,24 +1613,17 @@ def confirmar_paso(event, context):
     origen = event.get("origen")
     destino = event.get("destino")
 
-    if not tenant_id or not id_pedido or not paso:
-        return {
-            "statusCode": 400,
-            "body": json.dumps({
-                "mensaje": "Faltan tenant_id, id_pedido o paso",
-                "event": event
-            })
-        }
-
     # 1) Leer pedido de Dynamo
     try:
-        resp = tabla_pedidos.get_item(
+        resp = llamar_aws(tabla_pedidos.get_item, context,
             Key={
                 "tenant_id": tenant_id,
                 "id": id_pedido
             }
         )
     except Exception as e:
+        if es_error_transitorio(e):
+            raise  # con_proteccion_aws responde 503
         print("ERROR get_item:", repr(e))
         return {
             "statusCode": 500,
@@ -643,14 +1674,14 @@ def confirmar_paso(event, context):
     try:
         # 2.a) Actualizar COCINA / DESPACHADOR / DELIVERY según el paso
         if paso == "cocina-lista" and id_empleado:
-            tabla_cocina.update_item(
+            llamar_aws(tabla_cocina.update_item, context,
                 Key={"id_pedido": id_pedido},
                 UpdateExpression="SET id_empleado = :e",
                 ExpressionAttributeValues={":e": id_empleado}
             )
 
         elif paso == "empaquetamiento-listo" and id_empleado:
-            tabla_despachador.update_item(
+            llamar_aws(tabla_despachador.update_item, context,
                 Key={"id_pedido": id_pedido},
                 UpdateExpression="SET id_empleado = :e",
                 ExpressionAttributeValues={":e": id_empleado}
@@ -674,14 +1705,14 @@ def confirmar_paso(event, context):
                 expr_vals[":d"] = destino
 
             if update_expr:
-                tabla_delivery.update_item(
+                llamar_aws(tabla_delivery.update_item, context,
                     Key={"id_pedido": id_pedido},
                     UpdateExpression="SET " + ", ".join(update_expr),
                     ExpressionAttributeValues=expr_vals
                 )
 
         # 2.b) Enviar callback a Step Functions
-        resp_sf = stepfunctions_client.send_task_success(
+        resp_sf = llamar_aws(stepfunctions_client.send_task_success, context,
             taskToken=task_token,
             output=json.dumps({
                 "tenant_id": tenant_id,
@@ -692,6 +1723,8 @@ def confirmar_paso(event, context):
         print("DEBUG send_task_success resp:", resp_sf)
 
     except Exception as e:
+        if es_error_transitorio(e):
+            raise  # con_proteccion_aws responde 503
         print("ERROR send_task_success o update:", repr(e))
         return {
             "statusCode": 500,
@@ -703,7 +1736,7 @@ def confirmar_paso(event, context):
 
     # 3) Limpiar el token del pedido
     try:
-        tabla_pedidos.update_item(
+        llamar_aws(tabla_pedidos.update_item, context,
             Key={
                 "tenant_id": tenant_id,
                 "id": id_pedido
@@ -0,0 +1,255 @@
+"""
+Stub local de DynamoDB / Step Functions / SQS con inyección de fallos.
+
+Sirve para probar estado_pedidos sin AWS: throttling, errores 5xx y latencia.
+
+    import estado_pedidos, stub_aws
+    stub = stub_aws.instalar(estado_pedidos, tasa_fallos=0.3, semilla=1)
+    stub.tablas["pedidos"].items[("T1", "P1")] = {"tenant_id": "T1", "id": "P1", "estado_pedido": "pagado"}
+    estado_pedidos.pagado_a_cocina({...}, stub_aws.ContextoFalso())
+"""
+import copy
+import random
+import re
+import time
+
+from botocore.exceptions import ClientError
+
+
+class InyectorFallos:
+    """
+    Decide, llamada por llamada, si se lanza un error.
+      - tasa_fallos: probabilidad (0..1) de fallar cada llamada
+      - fallar_proximas: fuerza que las siguientes N llamadas fallen
+      - latencia_s: espera antes de cada llamada (para probar deadlines)
+    al_intentar(response=...) imita el evento 'needs-retry' de botocore en cada fallo.
+    """
+
+    def __init__(self, tasa_fallos=0.0, codigo="ProvisionedThroughputExceededException",
+                 status=400, latencia_s=0.0, semilla=None):
+        self.tasa_fallos = tasa_fallos
+        self.codigo = codigo
+        self.status = status
+        self.latencia_s = latencia_s
+        self.fallar_proximas = 0
+        self.llamadas = 0
+        self.fallos = 0
+        self.al_intentar = None
+        self._random = random.Random(semilla)
+
+    def verificar(self, operacion):
+        self.llamadas += 1
+        if self.latencia_s:
+            time.sleep(self.latencia_s)
+        if self.fallar_proximas > 0 or self._random.random() < self.tasa_fallos:
+            self.fallar_proximas = max(0, self.fallar_proximas - 1)
+            self.fallos += 1
+            respuesta = {
+                "Error": {"Code": self.codigo, "Message": "Fallo inyectado por stub_aws"},
+                "ResponseMetadata": {"HTTPStatusCode": self.status, "RetryAttempts": 0}
+            }
+            if self.al_intentar:
+                self.al_intentar(response=(None, respuesta))
+            raise ClientError(respuesta, operacion)
+
+
+def _respuesta(**extra):
+    extra["ResponseMetadata"] = {"HTTPStatusCode": 200, "RetryAttempts": 0}
+    return extra
+
+
+class TablaFalsa:
+    """
+    Tabla DynamoDB en memoria. Soporta get_item, put_item, update_item (SET / REMOVE simples,
+    ConditionExpression "a = :v" / "attribute_not_exists(a)" unidas con OR, ReturnValues ALL_NEW)
+    y query por clave de partición, ordenada por clave de rango (con FilterExpression IN opcional).
+    """
+
+    def __init__(self, name, clave_hash, clave_rango=None, inyector=None):
+        self.name = name
+        self.clave_hash = clave_hash
+        self.clave_rango = clave_rango
+        self.inyector = inyector or InyectorFallos()
+        self.items = {}
+
+    def _clave(self, key):
+        if self.clave_rango:
+            return (key[self.clave_hash], key[self.clave_rango])
+        return key[self.clave_hash]
+
+    def get_item(self, Key):
+        self.inyector.verificar("GetItem")
+        item = self.items.get(self._clave(Key))
+        if item is None:
+            return _respuesta()
+        return _respuesta(Item=copy.deepcopy(item))
+
+    def put_item(self, Item):
+        self.inyector.verificar("PutItem")
+        self.items[self._clave(Item)] = copy.deepcopy(Item)
+        return _respuesta()
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ConditionExpression=None, ReturnValues=None):
+        self.inyector.verificar("UpdateItem")
+        nombres = ExpressionAttributeNames or {}
+        valores = ExpressionAttributeValues or {}
+        actual = self.items.get(self._clave(Key), {})
+
+        if ConditionExpression and not any(
+                self._cumple(c.strip(), actual, nombres, valores) for c in ConditionExpression.split(" OR ")):
+            raise ClientError(
+                {
+                    "Error": {"Code": "ConditionalCheckFailedException", "Message": "Condición no cumplida"},
+                    "ResponseMetadata": {"HTTPStatusCode": 400, "RetryAttempts": 0}
+                },
+                "UpdateItem"
+            )
+
+        item = self.items.setdefault(self._clave(Key), copy.deepcopy(Key))
+
+        for accion, cuerpo in re.findall(r"(SET|REMOVE)\s+(.*?)(?=\s+(?:SET|REMOVE)\s|$)", UpdateExpression):
+            for parte in cuerpo.split(","):
+                parte = parte.strip()
+                if accion == "SET":
+                    nombre, valor = [p.strip() for p in parte.split("=", 1)]
+                    item[nombres.get(nombre, nombre)] = copy.deepcopy(valores[valor])
+                else:
+                    item.pop(nombres.get(parte, parte), None)
+        if ReturnValues == "ALL_NEW":
+            return _respuesta(Attributes=copy.deepcopy(item))
+        return _respuesta()
+
+    @staticmethod
+    def _cumple(condicion, actual, nombres, valores):
+        existe = re.fullmatch(r"attribute_not_exists\((.+)\)", condicion)
+        if existe:
+            return nombres.get(existe.group(1), existe.group(1)) not in actual
+        nombre, valor = [p.strip() for p in condicion.split("=", 1)]
+        return actual.get(nombres.get(nombre, nombre)) == valores[valor]
+
+    def query(self, KeyConditionExpression, FilterExpression=None, **kwargs):
+        self.inyector.verificar("Query")
+        # Key("x").eq(v) -> Equals(Key("x"), v)
+        valor = KeyConditionExpression.get_expression()["values"][1]
+        items = [copy.deepcopy(i) for i in self.items.values() if i.get(self.clave_hash) == valor]
+        if self.clave_rango:
+            items.sort(key=lambda i: i[self.clave_rango])  # DynamoDB devuelve por clave de rango
+        if FilterExpression is not None:
+            # Attr("x").is_in([...]) -> In(Attr("x"), [...])
+            atributo, aceptados = FilterExpression.get_expression()["values"]
+            items = [i for i in items if i.get(atributo.name) in aceptados]
+        return _respuesta(Items=items, Count=len(items))
+
+
+class DynamoFalso:
+    """
+    Recurso DynamoDB en memoria para batch_get_item / batch_write_item.
+    no_procesar: cantidad de claves/items que se devuelven como Unprocessed en la
+    próxima llamada (para probar reintentos parciales).
+    """
+
+    def __init__(self, tablas, inyector):
+        self.tablas = {t.name: t for t in tablas}
+        self.inyector = inyector
+        self.no_procesar = 0
+
+    def _separar(self, elementos):
+        corte = max(0, len(elementos) - self.no_procesar)
+        self.no_procesar = 0
+        return elementos[:corte], elementos[corte:]
+
+    def batch_get_item(self, RequestItems):
+        self.inyector.verificar("BatchGetItem")
+        respuestas, no_procesados = {}, {}
+        for nombre, pedido in RequestItems.items():
+            tabla = self.tablas[nombre]
+            procesar, resto = self._separar(pedido["Keys"])
+            respuestas[nombre] = [copy.deepcopy(tabla.items[tabla._clave(k)])
+                                  for k in procesar if tabla._clave(k) in tabla.items]
+            if resto:
+                no_procesados[nombre] = {"Keys": resto}
+        return _respuesta(Responses=respuestas, UnprocessedKeys=no_procesados)
+
+    def batch_write_item(self, RequestItems):
+        self.inyector.verificar("BatchWriteItem")
+        no_procesados = {}
+        for nombre, solicitudes in RequestItems.items():
+            tabla = self.tablas[nombre]
+            procesar, resto = self._separar(solicitudes)
+            for s in procesar:
+                item = s["PutRequest"]["Item"]
+                tabla.items[tabla._clave(item)] = copy.deepcopy(item)
+            if resto:
+                no_procesados[nombre] = resto
+        return _respuesta(UnprocessedItems=no_procesados)
+
+
+class SQSFalso:
+    def __init__(self, inyector=None):
+        self.inyector = inyector or InyectorFallos()
+        self.mensajes = []
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        self.inyector.verificar("SendMessage")
+        self.mensajes.append(dict(kwargs, QueueUrl=QueueUrl, MessageBody=MessageBody))
+        return _respuesta(MessageId=str(len(self.mensajes)))
+
+
+class StepFunctionsFalso:
+    def __init__(self, inyector=None):
+        self.inyector = inyector or InyectorFallos()
+        self.callbacks = []
+
+    def send_task_success(self, taskToken, output):
+        self.inyector.verificar("SendTaskSuccess")
+        self.callbacks.append({"taskToken": taskToken, "output": output})
+        return _respuesta()
+
+
+class ContextoFalso:
+    """Imita el context de Lambda con un tiempo límite configurable."""
+
+    def __init__(self, timeout_ms=30000):
+        self._fin = time.monotonic() + timeout_ms / 1000.0
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._fin - time.monotonic()) * 1000))
+
+
+class StubAWS:
+    def __init__(self, modulo, inyector):
+        self.inyector = inyector
+        self.tablas = {
+            "pedidos": TablaFalsa(modulo.TABLA_PEDIDOS, "tenant_id", "id", inyector),
+            "cocina": TablaFalsa(modulo.TABLA_COCINA, "id_pedido", inyector=inyector),
+            "despachador": TablaFalsa(modulo.TABLA_DESPACHADOR, "id_pedido", inyector=inyector),
+            "delivery": TablaFalsa(modulo.TABLA_DELIVERY, "id_pedido", inyector=inyector),
+            "tiempos_cocina": TablaFalsa(modulo.TABLA_TIEMPOS_COCINA, "tenant_id", inyector=inyector)
+        }
+        self.dynamodb = DynamoFalso(self.tablas.values(), inyector)
+        self.stepfunctions = StepFunctionsFalso(inyector)
+        self.sqs = SQSFalso(inyector)
+
+
+def instalar(modulo, **opciones_inyector):
+    """
+    Reemplaza las tablas y los clientes de DynamoDB / Step Functions / SQS del módulo
+    (estado_pedidos) por versiones en memoria, y reinicia métricas y circuito.
+    """
+    stub = StubAWS(modulo, InyectorFallos(**opciones_inyector))
+    stub.inyector.al_intentar = modulo.contar_intento_aws
+    modulo.dynamodb = stub.dynamodb
+    modulo.tabla_pedidos = stub.tablas["pedidos"]
+    modulo.tabla_cocina = stub.tablas["cocina"]
+    modulo.tabla_despachador = stub.tablas["despachador"]
+    modulo.tabla_delivery = stub.tablas["delivery"]
+    modulo.tabla_tiempos_cocina = stub.tablas["tiempos_cocina"]
+    modulo.cache_modelo_cocina.clear()
+    modulo.stepfunctions_client = stub.stepfunctions
+    modulo.sqs_client = stub.sqs
+    for k in modulo.metricas_aws:
+        modulo.metricas_aws[k] = 0
+    modulo.estado_circuito["fallos_consecutivos"] = 0
+    modulo.estado_circuito["abierto_hasta"] = 0.0
+    return stub
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# estado_pedidos crea los clientes boto3 al importarse
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,196 @@
+import json
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+
+import estado_pedidos
+import stub_aws
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(estado_pedidos, "esperar_con_backoff", lambda base_s, vuelta, context: True)
+    return stub_aws.instalar(estado_pedidos)
+
+
+def hace(segundos):
+    return (datetime.now(timezone.utc) - timedelta(seconds=segundos)).isoformat()
+
+
+def crear_pedido(stub, id_pedido, estado, hora_comienzo=None, tenant_id="T1"):
+    stub.tablas["pedidos"].items[(tenant_id, id_pedido)] = {
+        "tenant_id": tenant_id, "id": id_pedido, "estado_pedido": estado
+    }
+    if hora_comienzo:
+        stub.tablas["cocina"].items[id_pedido] = {
+            "id_pedido": id_pedido, "id_empleado": "E1", "hora_comienzo": hora_comienzo,
+            "hora_fin": None, "status": "cocinando"
+        }
+
+
+def consultar_cola(tenant_id="T1"):
+    respuesta = estado_pedidos.cola_cocina({
+        "requestContext": {"http": {"method": "GET"}},
+        "queryStringParameters": {"tenant_id": tenant_id}
+    }, stub_aws.ContextoFalso())
+    return respuesta["statusCode"], json.loads(respuesta["body"])
+
+
+# ------------------------- actualizar_modelo ------------------------- #
+
+def test_arranque_con_media_simple():
+    modelo = estado_pedidos.modelo_vacio("T1")
+    for duracion_s in (100, 200, 300):
+        modelo = estado_pedidos.actualizar_modelo(modelo, duracion_s)
+
+    # alfa = 1, 1/2, 1/3: media y varianza poblacional exactas de las 3 muestras
+    assert modelo["promedio_s"] == pytest.approx(200)
+    assert modelo["varianza_s"] == pytest.approx(20000 / 3)
+    assert (modelo["muestras"], modelo["version"]) == (3, 3)
+
+
+def test_con_muestras_suficientes_usa_alfa_fijo(monkeypatch):
+    monkeypatch.setattr(estado_pedidos, "ALFA_TIEMPO_COCINA", 0.1)
+    modelo = {"tenant_id": "T1", "promedio_s": 100.0, "varianza_s": 0.0, "muestras": 20, "version": 7}
+
+    nuevo = estado_pedidos.actualizar_modelo(modelo, 200)
+
+    assert nuevo["promedio_s"] == pytest.approx(110)
+    assert nuevo["varianza_s"] == pytest.approx(0.9 * 100 * 10)
+    assert (nuevo["muestras"], nuevo["version"]) == (21, 8)
+    assert modelo["promedio_s"] == 100.0  # no modifica el modelo recibido
+
+
+# ------------------------- estimar_cola_cocina ------------------------- #
+
+def test_estimacion_con_capacidad(monkeypatch):
+    monkeypatch.setattr(estado_pedidos, "CAPACIDAD_COCINA", 2)
+    ahora = datetime.now(timezone.utc)
+    en_curso = [("A", (ahora - timedelta(seconds=400)).isoformat()),
+                ("B", (ahora - timedelta(seconds=100)).isoformat())]
+
+    cola = estado_pedidos.estimar_cola_cocina(en_curso, ["C", "D", "E"], 300, ahora.isoformat())
+
+    assert [(p, estado, round(eta)) for p, estado, _, eta in cola] == [
+        ("A", "cocina", 0),      # ya pasó el promedio
+        ("B", "cocina", 200),
+        ("C", "pagado", 300),    # toma el puesto de A
+        ("D", "pagado", 500),    # toma el puesto de B
+        ("E", "pagado", 600)     # toma el puesto de C
+    ]
+
+
+def test_estimacion_con_puestos_libres(monkeypatch):
+    monkeypatch.setattr(estado_pedidos, "CAPACIDAD_COCINA", 3)
+    ahora = datetime.now(timezone.utc).isoformat()
+
+    cola = estado_pedidos.estimar_cola_cocina([], ["C", "D", "E", "F"], 300, ahora)
+
+    assert [round(eta) for _, _, _, eta in cola] == [300, 300, 300, 600]
+
+
+# ------------------------- cola_cocina ------------------------- #
+
+def test_cola_sin_muestras_usa_tiempo_por_defecto(stub):
+    crear_pedido(stub, "P1", "pagado")
+
+    status, cuerpo = consultar_cola()
+
+    assert status == 200
+    assert cuerpo["modelo"]["muestras"] == 0
+    assert cuerpo["modelo"]["promedio_segundos"] == round(estado_pedidos.TIEMPO_COCINA_DEFECTO_S)
+    [pedido] = cuerpo["cola"]
+    assert pedido["eta_segundos"] == round(estado_pedidos.TIEMPO_COCINA_DEFECTO_S)
+
+
+def test_cola_ordenada_con_el_modelo_del_tenant(stub, monkeypatch):
+    monkeypatch.setattr(estado_pedidos, "CAPACIDAD_COCINA", 2)
+    stub.tablas["tiempos_cocina"].items["T1"] = {
+        "tenant_id": "T1", "promedio_s": Decimal("600"), "varianza_s": Decimal("3600"),
+        "muestras": 5, "version": 5
+    }
+    crear_pedido(stub, "P3", "cocina", hora_comienzo=hace(100))
+    crear_pedido(stub, "P4", "cocina", hora_comienzo=hace(700))
+    crear_pedido(stub, "P2", "pagado")
+    crear_pedido(stub, "P1", "pagado")
+    crear_pedido(stub, "P5", "entregado")
+    crear_pedido(stub, "X1", "pagado", tenant_id="OTRO")
+
+    status, cuerpo = consultar_cola()
+
+    assert status == 200
+    assert (cuerpo["en_cocina"], cuerpo["pendientes"]) == (2, 2)
+    assert cuerpo["modelo"] == {"promedio_segundos": 600, "desviacion_segundos": 60,
+                                "muestras": 5, "capacidad": 2}
+    assert [(p["id_pedido"], p["estado_pedido"], p["eta_segundos"]) for p in cuerpo["cola"]] == [
+        ("P4", "cocina", 0),
+        ("P3", "cocina", 500),
+        ("P1", "pagado", 600),
+        ("P2", "pagado", 1100)
+    ]
+    assert [p["posicion"] for p in cuerpo["cola"]] == [1, 2, 3, 4]
+
+
+def test_cola_responde_503_si_quedan_registros_de_cocina_sin_leer(stub, monkeypatch):
+    crear_pedido(stub, "P1", "cocina", hora_comienzo=hace(60))
+    crear_pedido(stub, "P2", "cocina", hora_comienzo=hace(30))
+    leer_original = stub.dynamodb.batch_get_item
+
+    def siempre_deja_uno(**kwargs):
+        stub.dynamodb.no_procesar = 1
+        return leer_original(**kwargs)
+
+    monkeypatch.setattr(stub.dynamodb, "batch_get_item", siempre_deja_uno)
+
+    status, cuerpo = consultar_cola()
+
+    assert status == 503
+    assert len(cuerpo["pedidos_sin_leer"]) == 1
+    assert cuerpo["pedidos_sin_leer"][0] in ("P1", "P2")
+
+
+# ------------------------- registrar_tiempos_cocina ------------------------- #
+
+def test_lote_actualiza_el_modelo_con_una_sola_escritura(stub, monkeypatch):
+    duraciones = {"P1": 100, "P2": 200, "P3": 300}
+    for id_pedido, duracion_s in duraciones.items():
+        crear_pedido(stub, id_pedido, "cocina", hora_comienzo=hace(duracion_s))
+    tabla_tiempos = stub.tablas["tiempos_cocina"]
+    escrituras = []
+    actualizar_original = tabla_tiempos.update_item
+
+    def contar_escrituras(**kwargs):
+        escrituras.append(kwargs)
+        return actualizar_original(**kwargs)
+
+    monkeypatch.setattr(tabla_tiempos, "update_item", contar_escrituras)
+
+    respuesta = estado_pedidos.cocina_a_empaquetamiento({"Records": [{
+        "eventSource": "aws:sqs",
+        "body": json.dumps({"tenant_id": "T1", "pedidos": [{"id_pedido": p} for p in duraciones]})
+    }]}, stub_aws.ContextoFalso())
+
+    assert json.loads(respuesta["body"])["exitosos"] == 3
+    assert len(escrituras) == 1
+    modelo = tabla_tiempos.items["T1"]
+    assert modelo["muestras"] == 3
+    assert float(modelo["promedio_s"]) == pytest.approx(200, abs=1)
+
+
+def test_conflicto_de_version_relee_y_aplica_todas_las_muestras(stub, monkeypatch):
+    tabla_tiempos = stub.tablas["tiempos_cocina"]
+    # Otro contenedor escribió después de que este contenedor cacheara el modelo
+    estado_pedidos.cache_modelo_cocina["T1"] = (estado_pedidos.modelo_vacio("T1"), float("inf"))
+    tabla_tiempos.items["T1"] = {"tenant_id": "T1", "promedio_s": Decimal("100"),
+                                 "varianza_s": Decimal("0"), "muestras": 1, "version": 1}
+
+    estado_pedidos.registrar_tiempos_cocina("T1", [
+        {"hora_comienzo": hace(200), "hora_fin": hace(0)},
+        {"hora_comienzo": hace(300), "hora_fin": hace(0)},
+        {"hora_comienzo": None, "hora_fin": hace(0)}  # sin duración: se ignora
+    ], stub_aws.ContextoFalso())
+
+    modelo = tabla_tiempos.items["T1"]
+    assert (modelo["muestras"], modelo["version"]) == (3, 3)
+    assert float(modelo["promedio_s"]) == pytest.approx(200, abs=1)
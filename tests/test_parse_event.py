@@ -0,0 +1,171 @@
+import json
+
+import pytest
+
+import estado_pedidos
+from estado_pedidos import (
+    ESQUEMA_OBTENER_PEDIDO,
+    ESQUEMA_TRANSICION,
+    Lote,
+    Solicitud,
+    parse_event
+)
+
+
+def evento_sqs(cuerpo):
+    return {"Records": [{"eventSource": "aws:sqs", "body": json.dumps(cuerpo)}]}
+
+
+def evento_http(body=None, path=None, query=None, **extra):
+    event = dict(extra, requestContext={"http": {"method": "POST" if body is not None else "GET"}})
+    if body is not None:
+        event["body"] = body if isinstance(body, str) else json.dumps(body)
+    if path is not None:
+        event["pathParameters"] = path
+    if query is not None:
+        event["queryStringParameters"] = query
+    return event
+
+
+def detalle_error(error):
+    assert error["statusCode"] == 400
+    return json.loads(error["body"])["detalle"]
+
+
+@pytest.mark.parametrize("event, fuente", [
+    (evento_sqs({"tenant_id": "T1", "id_pedido": "P1"}), "sqs"),
+    (evento_http(path={"id_pedido": "P1"}, query={"tenant_id": "T1"}), "http"),
+    ({"taskToken": "tok", "input": {"tenant_id": "T1", "id_pedido": "P1"}}, "task_token"),
+    ({"tenant_id": "T1", "id_pedido": "P1"}, "directo")
+])
+def test_despacho_por_fuente(event, fuente):
+    solicitud, error = parse_event(event, ESQUEMA_TRANSICION)
+
+    assert error is None
+    assert isinstance(solicitud, Solicitud)
+    assert solicitud.fuente == fuente
+    assert (solicitud.get("tenant_id"), solicitud.get("id_pedido")) == ("T1", "P1")
+
+
+def test_task_token_queda_en_la_solicitud():
+    solicitud, _ = parse_event({"taskToken": "tok", "input": {"tenant_id": "T1", "id_pedido": "P1"}},
+                               ESQUEMA_TRANSICION)
+    assert solicitud.get("taskToken") == "tok"
+    assert solicitud.a_dict() == {"tenant_id": "T1", "id_pedido": "P1", "taskToken": "tok"}
+
+
+def test_sobre_sqs_es_un_lote():
+    event = evento_sqs({"tenant_id": "T1", "pedidos": [{"id_pedido": "P1"}, {"id_pedido": "P2"}]})
+    event["Records"][0]["eventSourceARN"] = "arn:aws:sqs:us-east-1:1:COLA.fifo"
+
+    lote, error = parse_event(event, ESQUEMA_TRANSICION)
+
+    assert error is None
+    assert isinstance(lote, Lote)
+    assert [s.get("id_pedido") for s in lote.pedidos] == ["P1", "P2"]
+    assert lote.pedidos[0].get("tenant_id") == "T1"  # campo común del sobre
+    assert (lote.intento, lote.origen_arn) == (0, "arn:aws:sqs:us-east-1:1:COLA.fifo")
+
+
+def test_prioridad_body_path_query():
+    event = evento_http(
+        body={"tenant_id": "DEL_BODY"},
+        path={"tenant_id": "DEL_PATH", "id_pedido": "P_PATH"},
+        query={"tenant_id": "DE_QUERY", "id_pedido": "P_QUERY", "id_empleado": "E1"}
+    )
+
+    solicitud, error = parse_event(event, ESQUEMA_TRANSICION)
+
+    assert error is None
+    assert solicitud.get("tenant_id") == "DEL_BODY"
+    assert solicitud.get("id_pedido") == "P_PATH"
+    assert solicitud.get("id_empleado") == "E1"
+    assert "id_empleado" in solicitud and "repartidor" not in solicitud
+    assert solicitud.a_dict() == {"tenant_id": "DEL_BODY", "id_pedido": "P_PATH", "id_empleado": "E1"}
+
+
+@pytest.mark.parametrize("datos, mensaje", [
+    ({"id_pedido": "P1"}, "Faltan campos requeridos: tenant_id"),
+    ({"tenant_id": "", "id_pedido": "P1"}, "Faltan campos requeridos: tenant_id"),
+    ({}, "Faltan campos requeridos: tenant_id, id_pedido"),
+    ({"tenant_id": 7, "id_pedido": "P1"}, "El campo 'tenant_id' tiene un tipo inválido"),
+    ({"tenant_id": "T1", "id_pedido": "P1", "id_empleado": ["E1"]},
+     "El campo 'id_empleado' tiene un tipo inválido"),
+    ({"tenant_id": "T1", "id_pedido": "P1", "repartidor": 3}, "El campo 'repartidor' tiene un tipo inválido")
+])
+def test_errores_de_esquema(datos, mensaje):
+    solicitud, error = parse_event(datos, ESQUEMA_TRANSICION)
+
+    assert solicitud is None
+    assert detalle_error(error) == mensaje
+
+
+def test_tipos_alternativos_y_opcionales():
+    solicitud, error = parse_event({"tenant_id": "T1", "id_pedido": "P1", "id_empleado": 7}, ESQUEMA_TRANSICION)
+    assert error is None
+    assert solicitud.get("id_empleado") == 7
+
+
+@pytest.mark.parametrize("body", ["[1, 2]", "3", '"texto"', "null"])
+def test_body_json_que_no_es_objeto(body):
+    _, error = parse_event(evento_http(body=body, query={"tenant_id": "T1"}), ESQUEMA_TRANSICION)
+    assert detalle_error(error) == "El body debe ser un objeto JSON"
+
+
+def test_body_que_no_es_json():
+    _, error = parse_event(evento_http(body="{no es json", query={"tenant_id": "T1"}), ESQUEMA_TRANSICION)
+    assert detalle_error(error).startswith("Body no es JSON válido")
+
+
+def test_body_base64_no_soportado():
+    _, error = parse_event(evento_http(body="e30=", isBase64Encoded=True), ESQUEMA_TRANSICION)
+    assert detalle_error(error) == "Body en base64 no soportado"
+
+
+def test_alias_id_para_id_pedido():
+    solicitud, error = parse_event({"tenant_id": "T1", "id": "P1"}, ESQUEMA_TRANSICION)
+    assert error is None
+    assert solicitud.get("id") == "P1"
+
+
+def test_alias_path_id_pedido():
+    solicitud, error = parse_event({"tenant_id": "T1", "path_id_pedido": "P1"}, ESQUEMA_OBTENER_PEDIDO)
+    assert error is None
+    assert solicitud.get("path_id_pedido") == "P1"
+
+    _, error = parse_event({"tenant_id": "T1", "id": "P1"}, ESQUEMA_OBTENER_PEDIDO)
+    assert detalle_error(error) == "Faltan campos requeridos: id_pedido"
+
+
+def test_sin_esquema_no_valida():
+    solicitud, error = parse_event({"cualquier": "cosa"})
+    assert error is None
+    assert solicitud.get("cualquier") == "cosa"
+
+
+@pytest.mark.parametrize("records, mensaje", [
+    ([], "'Records' debe ser una lista no vacía"),
+    ({}, "'Records' debe ser una lista no vacía"),
+    ("x", "'Records' debe ser una lista no vacía"),
+    (None, "'Records' debe ser una lista no vacía"),
+    ([1], "Cada record de 'Records' debe ser un objeto"),
+    (["x"], "Cada record de 'Records' debe ser un objeto"),
+    ([{"eventSource": "aws:s3"}], "eventSource no soportado: aws:s3")
+])
+def test_records_con_forma_invalida(records, mensaje):
+    solicitud, error = parse_event({"Records": records}, ESQUEMA_TRANSICION)
+
+    assert solicitud is None
+    assert detalle_error(error) == mensaje
+    assert not estado_pedidos.es_evento_sqs({"Records": records})
+
+
+@pytest.mark.parametrize("event, mensaje", [
+    ([], "El event debe ser un objeto"),
+    ("texto", "El event debe ser un objeto"),
+    ({"taskToken": "tok", "input": "no es objeto"}, "'input' debe ser un objeto cuando se envía taskToken"),
+    ({"taskToken": "tok"}, "'input' debe ser un objeto cuando se envía taskToken")
+])
+def test_eventos_invalidos(event, mensaje):
+    _, error = parse_event(event, ESQUEMA_TRANSICION)
+    assert detalle_error(error) == mensaje
@@ -0,0 +1,264 @@
+import json
+
+import pytest
+
+import estado_pedidos
+import stub_aws
+
+ARN_COLA = "arn:aws:sqs:us-east-1:123456789012:YAPAGADOS.fifo"
+URL_FALLIDOS = "https://sqs.us-east-1.amazonaws.com/123456789012/PEDIDOSFALLIDOS.fifo"
+
+
+@pytest.fixture
+def esperas(monkeypatch):
+    # El backoff (Unprocessed* y re-encolado) no aporta nada en los tests: solo se anota
+    llamadas = []
+
+    def sin_espera(base_s, vuelta, context):
+        llamadas.append((base_s, vuelta))
+        return True
+
+    monkeypatch.setattr(estado_pedidos, "esperar_con_backoff", sin_espera)
+    return llamadas
+
+
+@pytest.fixture
+def stub(monkeypatch, esperas):
+    monkeypatch.setattr(estado_pedidos, "COLA_PEDIDOS_FALLIDOS_URL", URL_FALLIDOS)
+    return stub_aws.instalar(estado_pedidos)
+
+
+def crear_pedidos(stub, estado, *ids, tenant_id="T1"):
+    for id_pedido in ids:
+        stub.tablas["pedidos"].items[(tenant_id, id_pedido)] = {
+            "tenant_id": tenant_id, "id": id_pedido, "estado_pedido": estado
+        }
+
+
+def evento_sobre(pedidos, tenant_id="T1", **extra):
+    cuerpo = dict(extra, tenant_id=tenant_id, pedidos=pedidos)
+    return {"Records": [{
+        "eventSource": "aws:sqs",
+        "eventSourceARN": ARN_COLA,
+        "body": json.dumps(cuerpo)
+    }]}
+
+
+def resultados_por_pedido(respuesta):
+    cuerpo = json.loads(respuesta["body"])
+    return {r["id_pedido"]: r["resultado"] for r in cuerpo["resultados"]}, cuerpo
+
+
+def test_resultado_por_pedido(stub):
+    crear_pedidos(stub, "pagado", "P1", "P2")
+    crear_pedidos(stub, "cocina", "P3")
+
+    respuesta = estado_pedidos.pagado_a_cocina(evento_sobre([
+        {"id_pedido": "P1", "id_empleado": "E1"},
+        {"id_pedido": "P2"},
+        {"id_pedido": "P3"},
+        {"id_pedido": "NO_EXISTE"},
+        {"id_pedido": "P1"},
+        {"id_pedido": "P9", "tenant_id": "OTRO"},
+        "no es un objeto"
+    ]), stub_aws.ContextoFalso())
+
+    cuerpo = json.loads(respuesta["body"])
+    assert [(r["id_pedido"], r["resultado"]) for r in cuerpo["resultados"]] == [
+        ("P1", "invalido"),   # repetido en el sobre: se procesa solo la primera aparición
+        ("P9", "invalido"),   # otro tenant
+        (6, "invalido"),      # sin id: se reporta por posición
+        ("P3", "estado_invalido"),
+        ("NO_EXISTE", "no_encontrado"),
+        ("P1", "ok"),
+        ("P2", "ok")
+    ]
+    assert cuerpo["exitosos"] == 2
+    assert stub.tablas["pedidos"].items[("T1", "P1")]["estado_pedido"] == "cocina"
+    assert stub.tablas["cocina"].items["P1"]["id_empleado"] == "E1"
+    assert stub.sqs.mensajes == []
+
+
+@pytest.mark.parametrize("pedidos", [None, 5, "ab", {"id_pedido": "P1"}])
+def test_pedidos_que_no_son_lista_invalidan_el_sobre(stub, pedidos):
+    respuesta = estado_pedidos.pagado_a_cocina(evento_sobre(pedidos), stub_aws.ContextoFalso())
+
+    # 400 (y no una excepción): el mensaje se consume en vez de reentregarse sin fin
+    assert respuesta["statusCode"] == 400
+    assert "'pedidos' debe ser una lista" in json.loads(respuesta["body"])["detalle"]
+    assert stub.sqs.mensajes == []
+
+
+def test_items_no_procesados_se_reencolan(stub, monkeypatch):
+    crear_pedidos(stub, "pagado", "P1", "P2", "P3")
+    escribir_original = stub.dynamodb.batch_write_item
+
+    def siempre_deja_uno(**kwargs):
+        stub.dynamodb.no_procesar = 1
+        return escribir_original(**kwargs)
+
+    monkeypatch.setattr(stub.dynamodb, "batch_write_item", siempre_deja_uno)
+
+    respuesta = estado_pedidos.pagado_a_cocina(
+        evento_sobre([{"id_pedido": p} for p in ("P1", "P2", "P3")], origen="web"),
+        stub_aws.ContextoFalso()
+    )
+
+    resultados, cuerpo = resultados_por_pedido(respuesta)
+    assert resultados == {"P1": "ok", "P2": "ok", "P3": "reencolado"}
+    assert cuerpo["reencolados"] == 1
+    # El pedido no escrito en COCINA no avanza en PEDIDOS
+    assert stub.tablas["pedidos"].items[("T1", "P3")]["estado_pedido"] == "pagado"
+
+    [mensaje] = stub.sqs.mensajes
+    assert mensaje["QueueUrl"] == "https://sqs.us-east-1.amazonaws.com/123456789012/YAPAGADOS.fifo"
+    assert mensaje["MessageGroupId"] == "T1"
+    assert json.loads(mensaje["MessageBody"]) == {
+        "tenant_id": "T1",
+        "origen": "web",
+        "pedidos": [{"id_pedido": "P3"}],
+        "intento": 1
+    }
+
+
+def test_claves_no_leidas_se_reintentan(stub):
+    crear_pedidos(stub, "pagado", "P1", "P2")
+    stub.dynamodb.no_procesar = 1  # solo la primera vuelta de BatchGetItem
+
+    respuesta = estado_pedidos.pagado_a_cocina(
+        evento_sobre([{"id_pedido": "P1"}, {"id_pedido": "P2"}]), stub_aws.ContextoFalso())
+
+    resultados, _ = resultados_por_pedido(respuesta)
+    assert resultados == {"P1": "ok", "P2": "ok"}
+
+
+def test_carrera_de_estado_no_se_reencola(stub, monkeypatch):
+    crear_pedidos(stub, "pagado", "P1", "P2")
+    tabla_pedidos = stub.tablas["pedidos"]
+    actualizar_original = tabla_pedidos.update_item
+
+    def otro_proceso_gana(**kwargs):
+        if kwargs["Key"]["id"] == "P2":
+            tabla_pedidos.items[("T1", "P2")]["estado_pedido"] = "cancelado"
+        return actualizar_original(**kwargs)
+
+    monkeypatch.setattr(tabla_pedidos, "update_item", otro_proceso_gana)
+
+    respuesta = estado_pedidos.pagado_a_cocina(
+        evento_sobre([{"id_pedido": "P1"}, {"id_pedido": "P2"}]), stub_aws.ContextoFalso())
+
+    resultados, _ = resultados_por_pedido(respuesta)
+    assert resultados == {"P1": "ok", "P2": "estado_invalido"}
+    assert tabla_pedidos.items[("T1", "P2")]["estado_pedido"] == "cancelado"
+    assert stub.sqs.mensajes == []
+
+
+def test_throttling_en_pedidos_reencola_solo_el_fallido(stub, monkeypatch):
+    crear_pedidos(stub, "cocina", "P1", "P2")
+    for id_pedido in ("P1", "P2"):
+        stub.tablas["cocina"].items[id_pedido] = {
+            "id_pedido": id_pedido, "hora_comienzo": estado_pedidos.obtener_timestamp_iso(),
+            "status": "cocinando"
+        }
+    tabla_pedidos = stub.tablas["pedidos"]
+    actualizar_original = tabla_pedidos.update_item
+
+    def throttling_en_p1(**kwargs):
+        if kwargs["Key"]["id"] == "P1":
+            stub.inyector.fallar_proximas = 1
+        return actualizar_original(**kwargs)
+
+    monkeypatch.setattr(tabla_pedidos, "update_item", throttling_en_p1)
+
+    respuesta = estado_pedidos.cocina_a_empaquetamiento(
+        evento_sobre([{"id_pedido": "P1"}, {"id_pedido": "P2"}]), stub_aws.ContextoFalso())
+
+    resultados, _ = resultados_por_pedido(respuesta)
+    assert resultados == {"P1": "reencolado", "P2": "ok"}
+    assert json.loads(stub.sqs.mensajes[0]["MessageBody"])["pedidos"] == [{"id_pedido": "P1"}]
+
+    # La reentrega completa P1 sin volver a cerrar COCINA ni contar su tiempo
+    hora_fin = stub.tablas["cocina"].items["P1"]["hora_fin"]
+    monkeypatch.setattr(tabla_pedidos, "update_item", actualizar_original)
+    reentrega = evento_sobre(json.loads(stub.sqs.mensajes[0]["MessageBody"])["pedidos"], intento=1)
+    resultados, _ = resultados_por_pedido(
+        estado_pedidos.cocina_a_empaquetamiento(reentrega, stub_aws.ContextoFalso()))
+    assert resultados == {"P1": "ok"}
+    assert stub.tablas["cocina"].items["P1"]["hora_fin"] == hora_fin
+    assert stub.tablas["tiempos_cocina"].items["T1"]["muestras"] == 1  # solo P2
+
+
+def test_sin_intentos_restantes_no_se_reencola(stub):
+    crear_pedidos(stub, "pagado", "P1")
+    stub.inyector.fallar_proximas = 1  # falla el BatchGetItem
+
+    respuesta = estado_pedidos.pagado_a_cocina(
+        evento_sobre([{"id_pedido": "P1"}], intento=estado_pedidos.MAX_INTENTOS_LOTE - 1),
+        stub_aws.ContextoFalso()
+    )
+
+    resultados, cuerpo = resultados_por_pedido(respuesta)
+    assert resultados == {"P1": "error"}
+    assert cuerpo["reencolados"] == 0
+    assert cuerpo["enviados_a_fallidos"] == 1
+
+    # No se reencola: el pedido va a la cola de fallidos con su detalle
+    [mensaje] = stub.sqs.mensajes
+    assert mensaje["QueueUrl"] == URL_FALLIDOS
+    assert mensaje["MessageGroupId"] == "T1"
+    assert json.loads(mensaje["MessageBody"]) == {
+        "tenant_id": "T1",
+        "intento": estado_pedidos.MAX_INTENTOS_LOTE - 1,
+        "transicion": "pagado -> cocina",
+        "pedidos": [{
+            "pedido": {"id_pedido": "P1"},
+            "detalle": f"Se agotaron los intentos del sobre ({estado_pedidos.MAX_INTENTOS_LOTE})"
+        }]
+    }
+
+
+def test_error_no_transitorio_va_a_fallidos(stub, capsys):
+    crear_pedidos(stub, "pagado", "P1", "P2")
+    stub.inyector.codigo = "ValidationException"
+    stub.inyector.fallar_proximas = 1  # falla el BatchWriteItem con un error definitivo
+
+    respuesta = estado_pedidos.pagado_a_cocina(
+        evento_sobre([{"id_pedido": "P1"}, {"id_pedido": "P2"}]), stub_aws.ContextoFalso())
+
+    resultados, cuerpo = resultados_por_pedido(respuesta)
+    assert resultados == {"P1": "error", "P2": "error"}
+    assert cuerpo["enviados_a_fallidos"] == 2
+    [mensaje] = stub.sqs.mensajes
+    assert mensaje["QueueUrl"] == URL_FALLIDOS
+    assert [p["pedido"]["id_pedido"] for p in json.loads(mensaje["MessageBody"])["pedidos"]] == ["P1", "P2"]
+    # Cada pedido fallido queda en el log con su id
+    log = capsys.readouterr().out
+    assert "pedido P1 del tenant T1 no procesado" in log
+    assert "pedido P2 del tenant T1 no procesado" in log
+
+
+def test_reencolado_espera_backoff_segun_intento(stub, esperas):
+    crear_pedidos(stub, "pagado", "P1")
+    stub.inyector.fallar_proximas = 1  # falla el BatchGetItem
+
+    estado_pedidos.pagado_a_cocina(evento_sobre([{"id_pedido": "P1"}], intento=2), stub_aws.ContextoFalso())
+
+    assert esperas == [(estado_pedidos.BACKOFF_REENCOLADO_S, 2)]
+    assert json.loads(stub.sqs.mensajes[0]["MessageBody"])["intento"] == 3
+
+
+def test_fallo_al_reencolar_devuelve_el_mensaje_a_sqs(stub, monkeypatch):
+    crear_pedidos(stub, "pagado", "P1", "P2")
+    enviar_original = stub.sqs.send_message
+    stub.inyector.fallar_proximas = 1  # falla el BatchGetItem: todo a reintentar
+
+    def sqs_caido(**kwargs):
+        stub.inyector.fallar_proximas = 1
+        return enviar_original(**kwargs)
+
+    monkeypatch.setattr(stub.sqs, "send_message", sqs_caido)
+
+    with pytest.raises(estado_pedidos.ClientError):
+        estado_pedidos.pagado_a_cocina(
+            evento_sobre([{"id_pedido": "P1"}, {"id_pedido": "P2"}]), stub_aws.ContextoFalso())
+    assert stub.sqs.mensajes == []
@@ -0,0 +1,298 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import boto3
+import pytest
+from botocore.exceptions import (
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    NoCredentialsError,
+    NoRegionError,
+    ParamValidationError,
+    ReadTimeoutError
+)
+
+import estado_pedidos
+import stub_aws
+
+
+@pytest.fixture
+def stub():
+    return stub_aws.instalar(estado_pedidos)
+
+
+@pytest.mark.parametrize("error", [
+    EndpointConnectionError(endpoint_url="https://dynamodb.us-east-1.amazonaws.com"),
+    ConnectTimeoutError(endpoint_url="https://dynamodb.us-east-1.amazonaws.com"),
+    ReadTimeoutError(endpoint_url="https://dynamodb.us-east-1.amazonaws.com"),
+    estado_pedidos.CircuitoAbierto(),
+    estado_pedidos.DeadlineExcedido()
+])
+def test_errores_de_red_son_transitorios(error):
+    assert estado_pedidos.es_error_transitorio(error)
+
+
+@pytest.mark.parametrize("error", [
+    ParamValidationError(report="Key inválida"),
+    NoCredentialsError(),
+    NoRegionError()
+])
+def test_errores_de_configuracion_no_son_transitorios(error):
+    assert not estado_pedidos.es_error_transitorio(error)
+
+
+def test_error_de_configuracion_no_abre_el_circuito(stub, monkeypatch):
+    def sin_credenciales(**kwargs):
+        raise NoCredentialsError()
+
+    monkeypatch.setattr(stub.tablas["pedidos"], "get_item", sin_credenciales)
+
+    for _ in range(estado_pedidos.CIRCUITO_UMBRAL_FALLOS):
+        with pytest.raises(NoCredentialsError):
+            estado_pedidos.llamar_aws(estado_pedidos.tabla_pedidos.get_item, stub_aws.ContextoFalso(),
+                                      Key={"tenant_id": "T1", "id": "P1"})
+    assert estado_pedidos.estado_circuito["fallos_consecutivos"] == 0
+    assert not estado_pedidos.obtener_metricas_aws()["circuito_abierto"]
+
+
+@pytest.fixture
+def dynamodb_local(monkeypatch):
+    """
+    Servidor HTTP local que imita DynamoDB: responde con throttling las primeras
+    'throttles' peticiones y después con un GetItem vacío.
+    """
+    estado = {"throttles": 0, "peticiones": 0}
+
+    class Manejador(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            estado["peticiones"] += 1
+            if estado["throttles"] > 0:
+                estado["throttles"] -= 1
+                status, cuerpo = 400, {
+                    "__type": "com.amazonaws.dynamodb.v20120810#ProvisionedThroughputExceededException",
+                    "message": "Throttling de prueba"
+                }
+            else:
+                status, cuerpo = 200, {}
+            datos = json.dumps(cuerpo).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/x-amz-json-1.0")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = HTTPServer(("127.0.0.1", 0), Manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    monkeypatch.setenv("AWS_ENDPOINT_URL_DYNAMODB", f"http://127.0.0.1:{servidor.server_port}")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "prueba")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "prueba")
+    monkeypatch.setattr(estado_pedidos, "clientes_por_presupuesto", {})
+    for k in estado_pedidos.metricas_aws:
+        monkeypatch.setitem(estado_pedidos.metricas_aws, k, 0)
+    monkeypatch.setitem(estado_pedidos.estado_circuito, "fallos_consecutivos", 0)
+    monkeypatch.setitem(estado_pedidos.estado_circuito, "abierto_hasta", 0.0)
+    yield estado
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def test_throttles_reintentados_con_exito_se_cuentan(dynamodb_local):
+    dynamodb_local["throttles"] = 1
+    recurso = boto3.resource("dynamodb", config=estado_pedidos.config_aws)
+    estado_pedidos.registrar_eventos_aws(recurso.meta.client)
+
+    estado_pedidos.llamar_aws(recurso.Table("PEDIDOS").get_item, None, Key={"tenant_id": "T1", "id": "P1"})
+
+    assert dynamodb_local["peticiones"] == 2
+    assert estado_pedidos.metricas_aws["throttles"] == 1
+    assert estado_pedidos.metricas_aws["reintentos"] == 1
+    assert estado_pedidos.metricas_aws["errores"] == 0
+
+
+def test_clientes_por_presupuesto_tambien_cuentan_throttles(dynamodb_local):
+    dynamodb_local["throttles"] = 1
+    # Recurso sin el handler: la llamada se hace con el cliente del presupuesto
+    tabla = boto3.resource("dynamodb", config=estado_pedidos.config_aws).Table("PEDIDOS")
+    contexto = stub_aws.ContextoFalso(timeout_ms=estado_pedidos.MARGEN_DEADLINE_MS + 10000)
+
+    estado_pedidos.llamar_aws(tabla.get_item, contexto, Key={"tenant_id": "T1", "id": "P1"})
+
+    assert list(estado_pedidos.clientes_por_presupuesto) == [("dynamodb", 2, estado_pedidos.AWS_READ_TIMEOUT)]
+    assert estado_pedidos.metricas_aws["throttles"] == 1
+
+
+def leer(context, **opciones):
+    return estado_pedidos.llamar_aws(estado_pedidos.tabla_pedidos.get_item, context,
+                                     Key={"tenant_id": "T1", "id": "P1"}, **opciones)
+
+
+def test_circuito_se_abre_tras_el_umbral_y_rechaza(stub):
+    umbral = estado_pedidos.CIRCUITO_UMBRAL_FALLOS
+    stub.inyector.fallar_proximas = umbral
+
+    for _ in range(umbral):
+        with pytest.raises(estado_pedidos.ClientError):
+            leer(stub_aws.ContextoFalso())
+    assert estado_pedidos.obtener_metricas_aws()["circuito_abierto"]
+
+    llamadas = stub.inyector.llamadas
+    with pytest.raises(estado_pedidos.CircuitoAbierto):
+        leer(stub_aws.ContextoFalso())
+    assert stub.inyector.llamadas == llamadas  # se rechaza sin llamar a AWS
+    assert estado_pedidos.metricas_aws["rechazos_circuito"] == 1
+    assert estado_pedidos.metricas_aws["throttles"] == umbral
+
+
+def test_circuito_se_recupera_tras_el_enfriamiento(stub, monkeypatch):
+    monkeypatch.setattr(estado_pedidos, "CIRCUITO_ENFRIAMIENTO_S", 0.05)
+    stub.inyector.fallar_proximas = estado_pedidos.CIRCUITO_UMBRAL_FALLOS
+    for _ in range(estado_pedidos.CIRCUITO_UMBRAL_FALLOS):
+        with pytest.raises(estado_pedidos.ClientError):
+            leer(stub_aws.ContextoFalso())
+    with pytest.raises(estado_pedidos.CircuitoAbierto):
+        leer(stub_aws.ContextoFalso())
+
+    time.sleep(0.1)
+    leer(stub_aws.ContextoFalso())
+    assert estado_pedidos.estado_circuito == {"fallos_consecutivos": 0, "abierto_hasta": 0.0}
+
+
+def test_un_exito_reinicia_los_fallos_consecutivos(stub):
+    stub.inyector.fallar_proximas = estado_pedidos.CIRCUITO_UMBRAL_FALLOS - 1
+    for _ in range(estado_pedidos.CIRCUITO_UMBRAL_FALLOS - 1):
+        with pytest.raises(estado_pedidos.ClientError):
+            leer(stub_aws.ContextoFalso())
+    leer(stub_aws.ContextoFalso())
+    stub.inyector.fallar_proximas = 1
+    with pytest.raises(estado_pedidos.ClientError):
+        leer(stub_aws.ContextoFalso())
+    assert not estado_pedidos.obtener_metricas_aws()["circuito_abierto"]
+
+
+def test_llamadas_que_no_afectan_el_circuito(stub):
+    stub.inyector.fallar_proximas = estado_pedidos.CIRCUITO_UMBRAL_FALLOS
+    for _ in range(estado_pedidos.CIRCUITO_UMBRAL_FALLOS):
+        with pytest.raises(estado_pedidos.ClientError):
+            leer(stub_aws.ContextoFalso(), afecta_circuito=False)
+    assert estado_pedidos.estado_circuito["fallos_consecutivos"] == 0
+
+
+def test_deadline_excedido_si_no_queda_tiempo(stub):
+    contexto = stub_aws.ContextoFalso(timeout_ms=estado_pedidos.MARGEN_DEADLINE_MS + 1000)
+
+    with pytest.raises(estado_pedidos.DeadlineExcedido):
+        leer(contexto)
+    assert stub.inyector.llamadas == 0
+    assert estado_pedidos.metricas_aws["deadlines_excedidos"] == 1
+
+
+def test_deadline_tras_una_llamada_lenta():
+    stub = stub_aws.instalar(estado_pedidos, latencia_s=0.3)
+    # 1.7 s de presupuesto: alcanza para un intento con read_timeout mínimo...
+    contexto = stub_aws.ContextoFalso(timeout_ms=estado_pedidos.MARGEN_DEADLINE_MS + 1700)
+    leer(contexto)
+    # ...pero tras 0.3 s de latencia ya no
+    with pytest.raises(estado_pedidos.DeadlineExcedido):
+        leer(contexto)
+    assert stub.inyector.llamadas == 1
+
+
+@pytest.mark.parametrize("presupuesto_s, esperado", [
+    (60, (3, 3.0)),
+    (15, (3, 3.0)),   # peor caso de 3 intentos: 3 * (1 + 3) + 1 + 2
+    (14.9, (2, 3.0)),
+    (9, (2, 3.0)),    # 2 * (1 + 3) + 1
+    (8.9, (1, 3.0)),
+    (4, (1, 3.0)),
+    (3.9, (1, 2.5)),  # un intento, read_timeout recortado en pasos de 0.5 s
+    (2.2, (1, 1.0)),
+    (1.5, (1, 0.5)),
+    (1.4, None),
+    (-1, None)
+])
+def test_configuracion_para_presupuesto(monkeypatch, presupuesto_s, esperado):
+    monkeypatch.setattr(estado_pedidos, "AWS_MAX_INTENTOS", 3)
+    monkeypatch.setattr(estado_pedidos, "AWS_CONNECT_TIMEOUT", 1.0)
+    monkeypatch.setattr(estado_pedidos, "AWS_READ_TIMEOUT", 3.0)
+    assert estado_pedidos.configuracion_para_presupuesto(presupuesto_s) == esperado
+
+
+def test_operacion_con_presupuesto_reutiliza_clientes(monkeypatch):
+    monkeypatch.setattr(estado_pedidos, "clientes_por_presupuesto", {})
+    tabla = boto3.resource("dynamodb").Table("PEDIDOS")
+
+    primera = estado_pedidos.operacion_con_presupuesto(tabla.get_item, 2, 3.0)
+    segunda = estado_pedidos.operacion_con_presupuesto(tabla.put_item, 2, 3.0)
+    envio = estado_pedidos.operacion_con_presupuesto(boto3.client("sqs").send_message, 1, 0.5)
+
+    assert primera.__self__.name == "PEDIDOS" and primera.__name__ == "get_item"
+    assert segunda.__name__ == "put_item"
+    config = primera.__self__.meta.client.meta.config
+    assert (config.retries["total_max_attempts"], config.read_timeout) == (2, 3.0)
+    assert envio.__self__.meta.config.read_timeout == 0.5
+    assert sorted(estado_pedidos.clientes_por_presupuesto) == [("dynamodb", 2, 3.0), ("sqs", 1, 0.5)]
+
+
+def test_operacion_con_presupuesto_no_toca_objetos_que_no_son_boto3(stub):
+    operacion = stub.tablas["pedidos"].get_item
+    assert estado_pedidos.operacion_con_presupuesto(operacion, 1, 0.5) == operacion
+
+
+EVENTO_HTTP = {
+    "requestContext": {"http": {"method": "GET"}},
+    "pathParameters": {"id_pedido": "P1"},
+    "queryStringParameters": {"tenant_id": "T1"}
+}
+
+EVENTO_SQS = {"Records": [{
+    "eventSource": "aws:sqs",
+    "body": json.dumps({"tenant_id": "T1", "id_pedido": "P1"})
+}]}
+
+
+def test_http_con_fallo_transitorio_responde_503(stub):
+    stub.inyector.fallar_proximas = 1
+
+    respuesta = estado_pedidos.obtener_pedido(EVENTO_HTTP, stub_aws.ContextoFalso())
+
+    assert respuesta["statusCode"] == 503
+
+
+def test_http_con_circuito_abierto_responde_503(stub):
+    estado_pedidos.estado_circuito["abierto_hasta"] = time.monotonic() + 60
+
+    respuesta = estado_pedidos.obtener_pedido(EVENTO_HTTP, stub_aws.ContextoFalso())
+
+    assert respuesta["statusCode"] == 503
+    assert stub.inyector.llamadas == 0
+
+
+def test_http_con_error_no_transitorio_no_es_503(stub):
+    stub.inyector.codigo = "ValidationException"
+    stub.inyector.fallar_proximas = 1
+
+    respuesta = estado_pedidos.obtener_pedido(EVENTO_HTTP, stub_aws.ContextoFalso())
+
+    assert respuesta["statusCode"] == 500
+
+
+def test_sqs_con_fallo_transitorio_relanza(stub):
+    stub.tablas["pedidos"].items[("T1", "P1")] = {"tenant_id": "T1", "id": "P1", "estado_pedido": "pagado"}
+    stub.inyector.fallar_proximas = 1
+
+    # La excepción devuelve el mensaje a la cola para que SQS lo reentregue
+    with pytest.raises(estado_pedidos.ClientError):
+        estado_pedidos.pagado_a_cocina(EVENTO_SQS, stub_aws.ContextoFalso())
+    assert stub.tablas["pedidos"].items[("T1", "P1")]["estado_pedido"] == "pagado"
+
+
+def test_sqs_con_deadline_relanza(stub):
+    with pytest.raises(estado_pedidos.DeadlineExcedido):
+        estado_pedidos.pagado_a_cocina(
+            EVENTO_SQS, stub_aws.ContextoFalso(timeout_ms=estado_pedidos.MARGEN_DEADLINE_MS))